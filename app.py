@@ -1,9 +1,27 @@
-from flask import Flask, request, g
+from flask import Flask, Response, request, g, stream_with_context, send_file, has_request_context
+from sqlalchemy import select, insert, delete, func, update, event, DDL, text, tuple_, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.schema import CreateTable, CreateIndex
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import os
+import json
 import datetime
+import itertools
+import csv
+import io
+import threading
+import time
+import sqlite3
+import shutil
+import hashlib
+import zlib
+import tempfile
+from urllib.parse import urlencode
 
 from flask_jwt_extended import (
     JWTManager,
@@ -12,7 +30,18 @@ from flask_jwt_extended import (
     get_jwt_identity,
 )
 
-from flask_restx import Api, Resource, fields, Namespace
+from flask_restx import Api, Resource, fields, Namespace, reqparse, inputs, marshal
+from flask_restx.utils import unpack
+
+from cache import create_response_cache, BACKEND_ERRORS
+from fastjson import get_encoder
+from iputils import ip_to_bin, ip_range_to_bin, parse_cidr, cidr_range, supernet_starts, to_mapped_network
+from ipindex import IPOwnershipIndex
+from groupcommit import GroupCommitter
+from jobs import JobRunner, new_job_id
+from sqliteprofile import get_profile, parse_pragmas, apply_pragmas
+from migrations import Migration, Migrator
+from writecoordinator import WriteCoordinator
 
 # -----------------------------------------------------------------------------
 # Flask + RESTX initialization
@@ -43,9 +72,17 @@ api = Api(
 # Namespaces
 auth_ns = Namespace("auth", description="Authentication operations")
 store_ns = Namespace("store", description="Store and item operations")
+item_ns = Namespace("item", description="Item queries across stores")
+lookup_ns = Namespace("lookup", description="In-memory IP ownership lookups")
+cache_ns = Namespace("cache", description="Response cache operations")
+jobs_ns = Namespace("jobs", description="Background jobs")
 
 api.add_namespace(auth_ns)
 api.add_namespace(store_ns)
+api.add_namespace(item_ns)
+api.add_namespace(lookup_ns)
+api.add_namespace(cache_ns)
+api.add_namespace(jobs_ns)
 
 # -----------------------------------------------------------------------------
 # JWT configuration
@@ -62,10 +99,84 @@ jwt = JWTManager(app)
 # -----------------------------------------------------------------------------
 os.makedirs(app.instance_path, exist_ok=True)
 db_path = os.path.join(app.instance_path, "data.db")
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+# The SQLite file allows one writer at a time across all replicas; point
+# SQLALCHEMY_DATABASE_URI at PostgreSQL (e.g. postgresql+psycopg2://user:pw@host/core,
+# with the driver installed) to lift that.
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("SQLALCHEMY_DATABASE_URI", f"sqlite:///{db_path}")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-db = SQLAlchemy(app)
+database_url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+if database_url.get_backend_name() == "postgresql":
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE_SECONDS", 1800)),
+        # Replace connections the server has dropped (restart, failover, idle
+        # timeout) instead of failing the request that checks one out.
+        "pool_pre_ping": True,
+        # Server-side limit per statement, set once per connection by libpq.
+        "connect_args": {"options": f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))}"},
+    }
+
+# Read requests use the "read" bind: by default a read-only pool on the same
+# SQLite file, whose connections never take the writer lock, or
+# SQLALCHEMY_READ_DATABASE_URI (e.g. a PostgreSQL replica). Set that to ""
+# to read from the primary.
+read_database_uri = os.environ.get("SQLALCHEMY_READ_DATABASE_URI")
+if read_database_uri is None and database_url.get_backend_name() == "sqlite" \
+        and database_url.database not in (None, "", ":memory:"):
+    read_database_uri = f"sqlite:///file:{database_url.database}?mode=ro&uri=true"
+if read_database_uri:
+    app.config["SQLALCHEMY_BINDS"] = {"read": read_database_uri}
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def reads_from_replica():
+    return (has_request_context() and request.method in READ_METHODS
+            and not g.get("read_from_primary", False))
+
+
+class RoutingSession(FlaskSession):
+    """Session that runs the statements of read requests on the "read" bind."""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and "read" in self._db.engines and reads_from_replica():
+            return self._db.engines["read"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+# Pragmas run on every SQLite connection; see sqliteprofile.py. SQLITE_PRAGMAS
+# overrides single settings, e.g. "busy_timeout=10000,mmap_size=0".
+sqlite_profile = get_profile(
+    os.environ.get("SQLITE_PROFILE", "wal"),
+    parse_pragmas(os.environ.get("SQLITE_PRAGMAS", "")),
+)
+
+
+@event.listens_for(Engine, "connect")
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        # Transactions are begun by begin_sqlite_transaction(), not the driver.
+        dbapi_connection.isolation_level = None
+        # SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked
+        # to, per connection.
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+        apply_pragmas(dbapi_connection, sqlite_profile.pragmas)
+
+
+@event.listens_for(Engine, "begin")
+def begin_sqlite_transaction(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    # A DEFERRED transaction that reads before it writes cannot wait for the
+    # write lock: SQLite fails it with "database is locked" at once. Write
+    # requests therefore take the lock up front, waiting up to busy_timeout.
+    immediate = (sqlite_profile.immediate_writes and has_request_context()
+                 and request.method not in READ_METHODS)
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
 
 # -----------------------------------------------------------------------------
 # Models (SQLAlchemy)
@@ -73,8 +184,10 @@ db = SQLAlchemy(app)
 class Store(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False, unique=True)
+    # Items are removed by ON DELETE CASCADE in the database; passive_deletes
+    # stops the ORM from loading them to delete one by one.
     items = db.relationship(
-        "Item", backref="store", lazy=True, cascade="all, delete-orphan"
+        "Item", backref="store", lazy=True, cascade="all, delete-orphan", passive_deletes=True
     )
 
     def to_dict(self):
@@ -82,14 +195,526 @@ class Store(db.Model):
 
 
 class Item(db.Model):
+    __table_args__ = (
+        db.Index("ix_item_store_id_name", "store_id", "name"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
-    ip = db.Column(db.String(40), nullable=False)
-    store_id = db.Column(db.Integer, db.ForeignKey("store.id"), nullable=False)
+    # Indexed for the DISTINCT ip counts of /store/stats (a covering scan).
+    ip = db.Column(db.String(40), nullable=False, index=True)
+    # 16-byte big-endian form of `ip` (IPv4 mapped into IPv6) for range
+    # scans: the address, or a prefix's first address with its last one in
+    # ip_bin_end (equal for an address). NULL when `ip` is neither.
+    ip_bin = db.Column(db.LargeBinary(16), index=True)
+    ip_bin_end = db.Column(db.LargeBinary(16))
+    # On its own (i.e. (store_id, id)) so a store's items come back in id
+    # order, for keyset pages and the export, without a sort; the
+    # (store_id, name) index serves item lookups by name.
+    store_id = db.Column(db.Integer, db.ForeignKey("store.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    @validates("ip")
+    def _encode_ip(self, key, value):
+        self.ip_bin, self.ip_bin_end = ip_range_to_bin(value)
+        return value
 
     def to_dict(self):
         return {"name": self.name, "ip": self.ip}
 
+
+class CatalogVersion(db.Model):
+    """Single-row counter bumped by every store/item write (drives ETags)."""
+    __tablename__ = "catalog_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+event.listen(
+    CatalogVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO catalog_version (id, version) VALUES (1, 0)"),
+)
+
+
+class Job(db.Model):
+    """A long-running operation executed by `job_runner` (see jobs.py)."""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    # queued -> running -> succeeded | failed
+    status = db.Column(db.String(20), nullable=False, index=True)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    result_location = db.Column(db.String(200))
+    error = db.Column(db.Text)
+    created_by = db.Column(db.String(80))
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # time.time() until which the worker running the job holds it
+    lease_until = db.Column(db.Float)
+    attempts = db.Column(db.Integer, default=0)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "progress": {"done": self.progress_done, "total": self.progress_total},
+            "result": self.result,
+            "result_location": self.result_location,
+            "error": self.error,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SchemaMigration(db.Model):
+    """Status and step progress of a versioned migration (see migrations.py)."""
+    __tablename__ = "schema_migration"
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    # pending -> running -> done | failed
+    status = db.Column(db.String(20), nullable=False)
+    step = db.Column(db.Integer, nullable=False, default=0)  # steps completed
+    cursor = db.Column(db.Integer)  # last key backfilled by the current step
+    owner = db.Column(db.String(200))  # replica holding the lease
+    lease_until = db.Column(db.Float)  # unix time
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class IdempotencyKey(db.Model):
+    """First response to a write sent with an Idempotency-Key header."""
+    __tablename__ = "idempotency_key"
+    # sha256 of (user, Idempotency-Key) and of (method, path, query, body)
+    key = db.Column(db.LargeBinary(32), primary_key=True)
+    fingerprint = db.Column(db.LargeBinary(32), nullable=False)
+    # NULL while the first request is still running
+    status = db.Column(db.Integer)
+    headers = db.Column(db.JSON)
+    body = db.Column(db.LargeBinary)  # zlib-compressed
+    # The write's catalog version, re-sent as X-Catalog-Version on replay
+    catalog_version = db.Column(db.Integer)
+    expires_at = db.Column(db.Integer, nullable=False, index=True)  # unix time
+
+# -----------------------------------------------------------------------------
+# Dialect helpers
+# -----------------------------------------------------------------------------
+def insert_stmt(model):
+    """INSERT for `model` with the dialect's ON CONFLICT / RETURNING support."""
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def bulk_insert_items(rows):
+    """
+    Insert (name, ip, store_id) rows in the current transaction: through COPY
+    on PostgreSQL, as one executemany INSERT elsewhere.
+    """
+    if db.engine.dialect.name == "postgresql":
+        cursor = db.session.connection().connection.dbapi_connection.cursor()
+        try:
+            if copy_items(cursor, rows):
+                return
+        finally:
+            cursor.close()
+    values = []
+    for name, ip, store_id in rows:
+        ip_bin, ip_bin_end = ip_range_to_bin(ip)
+        values.append({"name": name, "ip": ip, "ip_bin": ip_bin, "ip_bin_end": ip_bin_end, "store_id": store_id})
+    db.session.execute(insert(Item), values)
+
+
+def copy_items(cursor, rows):
+    """COPY rows into item with a psycopg2 or psycopg 3 cursor; False for other drivers."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for name, ip, store_id in rows:
+        # An empty unquoted CSV field is NULL; bytea is read in hex form.
+        ip_bin, ip_bin_end = ("\\x" + b.hex() if b is not None else None for b in ip_range_to_bin(ip))
+        writer.writerow((name, ip, ip_bin, ip_bin_end, store_id))
+    sql = "COPY item (name, ip, ip_bin, ip_bin_end, store_id) FROM STDIN WITH (FORMAT csv)"
+    if hasattr(cursor, "copy_expert"):
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+    elif hasattr(cursor, "copy"):
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+    else:
+        return False
+    return True
+
+# -----------------------------------------------------------------------------
+# JSON encoding for hot reads
+# -----------------------------------------------------------------------------
+# Hot read endpoints build plain dicts shaped like their RESTX models (which
+# still document them through @ns.response) and encode them in one pass,
+# instead of marshal() walking them again before Flask's encoder does.
+json_encoder_name, json_dumps = get_encoder(os.environ.get("JSON_ENCODER", "auto"))
+
+
+def json_response(data, status=200, headers=None):
+    return Response(json_dumps(data), status=status, headers=headers, mimetype="application/json")
+
+# -----------------------------------------------------------------------------
+# Catalog version / conditional GETs
+# -----------------------------------------------------------------------------
+def catalog_version():
+    return db.session.execute(select(CatalogVersion.version)).scalar() or 0
+
+
+def bump_catalog_version():
+    """Must run inside the write's transaction, before its commit. Returns the new version."""
+    version = db.session.execute(
+        update(CatalogVersion)
+        .values(version=CatalogVersion.version + 1)
+        .returning(CatalogVersion.version)
+    ).scalar()
+    if has_request_context():
+        g.catalog_version = version
+    return version
+
+
+# Read-your-writes: a write answers with X-Catalog-Version; a client that
+# sends it back as X-Min-Catalog-Version reads from the primary for as long
+# as the read bind has not caught up with that version.
+@app.before_request
+def read_your_writes():
+    min_version = request.headers.get("X-Min-Catalog-Version", type=int)
+    if min_version is not None and reads_from_replica() and "read" in db.engines:
+        if catalog_version() < min_version:
+            db.session.rollback()
+            g.read_from_primary = True
+
+
+@app.after_request
+def add_catalog_version_header(response):
+    version = g.get("catalog_version")
+    if version is not None:
+        response.headers["X-Catalog-Version"] = str(version)
+    return response
+
+
+def etag_on_catalog_version(f):
+    """
+    Answer If-None-Match with 304 straight from the catalog version, without
+    querying Store/Item. The version is read before the data, so a write
+    racing with the read can only make the ETag older than the body, which
+    costs the client one extra refetch but never serves stale data as fresh.
+    """
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        version = str(catalog_version())
+        g.etag_version = version
+        if request.if_none_match.contains(version):
+            response = Response(status=304)
+            response.set_etag(version)
+            return response
+
+        rv = f(*args, **kwargs)
+        if isinstance(rv, Response):
+            rv.set_etag(version)
+            return rv
+        data, code, headers = unpack(rv)
+        headers = dict(headers or {})
+        headers["ETag"] = f'"{version}"'
+        return data, code, headers
+    return wrapped
+
+# -----------------------------------------------------------------------------
+# Response cache
+# -----------------------------------------------------------------------------
+# "memory" is per process. Replicas sharing the instance volume should use
+# "sqlite" (default file: instance/cache.db) or "redis" so that a write on
+# one replica invalidates the other's cached reads.
+cache_backend = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+cache_url = os.environ.get("RESPONSE_CACHE_URL")
+if cache_backend == "sqlite" and not cache_url:
+    cache_url = os.path.join(app.instance_path, "cache.db")
+
+response_cache = create_response_cache(
+    cache_backend,
+    cache_url,
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+    ttl=int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 300)),
+)
+
+
+def cached_response(*tags):
+    """
+    Cache the encoded body of a 200 response, keyed by catalog version, path
+    and query string. A hit is therefore never older than the version a
+    request reads, even between a write's commit and its invalidate_reads()
+    call. Those use the view's tags, e.g. "store:{name}" with its URL
+    arguments, to free the entries of older versions early.
+
+    A backend that fails (Redis down, SQLite cache locked) only costs the
+    cache: the view runs uncached and the error is logged.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            # Reuse the version etag_on_catalog_version sent as the ETag.
+            version = g.get("etag_version") or catalog_version()
+            key = f"{version}:{request.path}?" + urlencode(sorted(request.args.items(multi=True)))
+            try:
+                hit = response_cache.get(key)
+                if hit is not None:
+                    body, headers = hit
+                    return Response(body, status=200, headers=headers)
+                generation = response_cache.generation()
+            except BACKEND_ERRORS:
+                app.logger.warning("response cache unavailable, serving %s uncached", request.path, exc_info=True)
+                return f(*args, **kwargs)
+
+            rv = f(*args, **kwargs)
+            response = rv if isinstance(rv, Response) else api.make_response(*unpack(rv))
+            if response.status_code == 200:
+                headers = [(k, v) for k, v in response.headers if k != "Content-Length"]
+                entry_tags = [tag.format(**kwargs) for tag in tags]
+                try:
+                    response_cache.set(key, (response.get_data(), headers), entry_tags, generation)
+                except BACKEND_ERRORS:
+                    app.logger.warning("response cache fill failed for %s", request.path, exc_info=True)
+            return response
+        return wrapped
+    return decorator
+
+
+def invalidate_reads(*store_names):
+    """Drop cached reads affected by a committed write to the given stores."""
+    try:
+        response_cache.invalidate("stores", *(f"store:{n}" for n in store_names))
+    except BACKEND_ERRORS:
+        # The write has committed and must still succeed. Entries are keyed by
+        # catalog version, so the ones left behind are never served again;
+        # they only wait for eviction or their TTL.
+        app.logger.warning("response cache invalidation failed", exc_info=True)
+
+# -----------------------------------------------------------------------------
+# Idempotency keys
+# -----------------------------------------------------------------------------
+# A write sent with an Idempotency-Key header runs once per (user, key): its
+# response is kept in the idempotency_key table, which replicas share, and
+# replayed to retries until it expires.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+# How long a key stays locked by a first request that never finished; a
+# request that is still running renews its lock every third of this.
+IDEMPOTENCY_LOCK_SECONDS = 60
+IDEMPOTENCY_PURGE_INTERVAL = 60
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Uploads hashed for the fingerprint are spooled to disk past this size.
+IDEMPOTENCY_SPOOL_MEMORY = 1024 * 1024
+
+_idempotency_next_purge = 0
+
+
+def request_fingerprint():
+    """sha256 of what makes two requests "the same" for an Idempotency-Key."""
+    digest = hashlib.sha256(f"{request.method} {request.full_path}\0{request.mimetype}\0".encode())
+    if request.mimetype == "application/json":
+        digest.update(request.get_data())
+        return digest.digest()
+
+    # Streamed uploads are hashed while being copied to a spool file (in
+    # memory while small), which the view then reads instead of the socket.
+    spool = tempfile.SpooledTemporaryFile(max_size=IDEMPOTENCY_SPOOL_MEMORY)
+    for chunk in iter(lambda: request.stream.read(64 * 1024), b""):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    request.environ["wsgi.input"] = spool
+    del request.stream  # werkzeug caches the (now consumed) stream
+    return digest.digest()
+
+
+def purge_idempotency_keys(now):
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+    db.session.commit()
+
+
+def release_idempotency_key(key):
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+    db.session.commit()
+
+
+def renew_idempotency_claim(key, stop):
+    """Keep a running request's claim locked (a bulk import can outlast the lock)."""
+    with app.app_context():
+        while not stop.wait(IDEMPOTENCY_LOCK_SECONDS / 3):
+            try:
+                db.session.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.key == key, IdempotencyKey.status.is_(None))
+                    .values(expires_at=int(time.time()) + IDEMPOTENCY_LOCK_SECONDS)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("renewing an Idempotency-Key claim failed")
+        db.session.remove()
+
+
+def idempotent(f):
+    """
+    Honour an Idempotency-Key header on a write; goes inside require_role.
+    A retry gets the stored response with an Idempotent-Replayed header, a
+    retry while the first request still runs gets 409, and reusing the key
+    for a different request gets 422. Exceptions and 5xx release the key.
+    """
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        global _idempotency_next_purge
+        raw_key = request.headers.get("Idempotency-Key")
+        if raw_key is None:
+            return f(*args, **kwargs)
+        if not raw_key or len(raw_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return {"message": f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}, 400
+
+        now = int(time.time())
+        if now >= _idempotency_next_purge:
+            _idempotency_next_purge = now + IDEMPOTENCY_PURGE_INTERVAL
+            purge_idempotency_keys(now)
+
+        key = hashlib.sha256(f"{g.current_user}\0{raw_key}".encode()).digest()
+        fingerprint = request_fingerprint()
+        lock = {"fingerprint": fingerprint, "expires_at": now + IDEMPOTENCY_LOCK_SECONDS}
+        # Claim the key, or take over an expired one, in a single statement so
+        # concurrent retries (on any replica) cannot both run the write.
+        claimed = db.session.execute(
+            insert_stmt(IdempotencyKey)
+            .values(key=key, **lock)
+            .on_conflict_do_update(
+                index_elements=["key"],
+                set_={**lock, "status": None, "headers": None, "body": None},
+                where=IdempotencyKey.expires_at < now,
+            )
+            .returning(IdempotencyKey.key)
+        ).scalar()
+        db.session.commit()
+
+        if claimed is None:
+            stored = db.session.execute(
+                select(IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.headers,
+                       IdempotencyKey.body, IdempotencyKey.catalog_version)
+                .where(IdempotencyKey.key == key)
+            ).first()
+            if stored is not None and stored.fingerprint != fingerprint:
+                return {"message": "Idempotency-Key was already used for a different request"}, 422
+            if stored is None or stored.status is None:
+                return {"message": "a request with this Idempotency-Key is still in progress"}, 409
+            response = Response(zlib.decompress(stored.body), status=stored.status, headers=stored.headers)
+            response.headers["Idempotent-Replayed"] = "true"
+            if stored.catalog_version is not None:
+                g.catalog_version = stored.catalog_version
+            return response
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=renew_idempotency_claim, args=(key, stop),
+                                     name="idempotency-claim", daemon=True)
+        heartbeat.start()
+        try:
+            try:
+                rv = f(*args, **kwargs)
+                response = rv if isinstance(rv, Response) else api.make_response(*unpack(rv))
+            finally:
+                # Stopped before the response is stored or the key released.
+                stop.set()
+                heartbeat.join()
+        except Exception:
+            db.session.rollback()
+            release_idempotency_key(key)
+            raise
+        if response.status_code >= 500:
+            release_idempotency_key(key)
+            return response
+
+        db.session.execute(
+            update(IdempotencyKey).where(IdempotencyKey.key == key).values(
+                status=response.status_code,
+                headers=[(k, v) for k, v in response.headers if k != "Content-Length"],
+                body=zlib.compress(response.get_data()),
+                catalog_version=g.get("catalog_version"),
+                expires_at=int(time.time()) + IDEMPOTENCY_TTL_SECONDS,
+            )
+        )
+        db.session.commit()
+        return response
+    # Namespace.doc only annotates the function; any namespace will do.
+    return store_ns.doc(params={"Idempotency-Key": {
+        "in": "header", "type": "string",
+        "description": f"Run this write once; retries within {IDEMPOTENCY_TTL_SECONDS}s replay its response",
+    }})(wrapped)
+
+# -----------------------------------------------------------------------------
+# IP ownership index
+# -----------------------------------------------------------------------------
+IP_INDEX_REFRESH_SECONDS = float(os.environ.get("IP_INDEX_REFRESH_SECONDS", 5))
+
+ip_index = IPOwnershipIndex()
+_ip_index_rebuild = threading.Lock()
+_ip_index_wakeup = threading.Event()
+
+
+def refresh_ip_index(force=False):
+    """
+    Rebuild the index if it is stale or another replica has written since.
+    Only one caller rebuilds at a time; the others return at once.
+    """
+    if not _ip_index_rebuild.acquire(blocking=False):
+        return
+    try:
+        version = catalog_version()
+        if not force and not ip_index.stale and ip_index.version == version:
+            return
+        rows = db.session.execute(
+            select(Store.name, Item.name, Item.ip)
+            .join(Item, Item.store_id == Store.id)
+            .execution_options(yield_per=5000)
+        )
+        ip_index.build(rows, version)
+    finally:
+        _ip_index_rebuild.release()
+
+
+def wake_ip_index_refresher():
+    """Ask the refresher thread for a rebuild instead of rebuilding inline."""
+    _ip_index_wakeup.set()
+
+
+def start_ip_index_refresher(interval):
+    """
+    Poll the catalog version in the background so writes made by the other
+    replica reach this process's index within `interval` seconds (with
+    interval <= 0, only when woken); local writes patch the index directly
+    via ip_index.apply().
+    """
+    def run():
+        while True:
+            _ip_index_wakeup.wait(interval if interval > 0 else None)
+            _ip_index_wakeup.clear()
+            with app.app_context():
+                try:
+                    refresh_ip_index()
+                except Exception:
+                    app.logger.exception("IP index refresh failed")
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name="ip-index-refresher", daemon=True)
+    thread.start()
+    return thread
+
 # -----------------------------------------------------------------------------
 # RESTX Models (OpenAPI)
 # -----------------------------------------------------------------------------
@@ -117,6 +742,161 @@ item_model = store_ns.model("Item", {
     "ip": fields.String
 })
 
+item_location_model = item_ns.model("ItemLocation", {
+    "name": fields.String,
+    "ip": fields.String,
+    "store": fields.String
+})
+
+store_summary_model = store_ns.clone("StoreSummary", store_model, {
+    "items": fields.List(fields.Nested(item_model)),
+    "item_count": fields.Integer
+})
+
+store_bulk_result_model = store_ns.model("StoreBulkResult", {
+    "name": fields.String,
+    "status": fields.String(enum=["created", "duplicate", "invalid"])
+})
+
+store_bulk_summary_model = store_ns.model("StoreBulkSummary", {
+    "created": fields.Integer,
+    "duplicate": fields.Integer,
+    "invalid": fields.Integer,
+    "results": fields.List(fields.Nested(store_bulk_result_model))
+})
+
+item_import_error_model = store_ns.model("ItemImportError", {
+    "line": fields.Integer,
+    "message": fields.String
+})
+
+item_import_summary_model = store_ns.model("ItemImportSummary", {
+    "accepted": fields.Integer,
+    "rejected": fields.Integer,
+    "errors": fields.List(fields.Nested(item_import_error_model)),
+    "errors_truncated": fields.Boolean
+})
+
+store_item_stats_model = store_ns.model("StoreItemStats", {
+    "name": fields.String,
+    "item_count": fields.Integer,
+    "distinct_ips": fields.Integer
+})
+
+catalog_stats_model = store_ns.model("CatalogStats", {
+    "version": fields.Integer,
+    "total_stores": fields.Integer,
+    "total_items": fields.Integer,
+    "distinct_ips": fields.Integer,
+    "stores": fields.List(fields.Nested(store_item_stats_model))
+})
+
+job_create_model = jobs_ns.model("JobCreate", {
+    "kind": fields.String(required=True, enum=["export", "delete_store"]),
+    "params": fields.Raw(description='delete_store: {"store": <name>}')
+})
+
+job_progress_model = jobs_ns.model("JobProgress", {
+    "done": fields.Integer,
+    "total": fields.Integer
+})
+
+job_model = jobs_ns.model("Job", {
+    "id": fields.String,
+    "kind": fields.String,
+    "status": fields.String(enum=["queued", "running", "succeeded", "failed"]),
+    "params": fields.Raw,
+    "progress": fields.Nested(job_progress_model),
+    "result": fields.Raw,
+    "result_location": fields.String,
+    "error": fields.String,
+    "created_by": fields.String,
+    "created_at": fields.DateTime,
+    "started_at": fields.DateTime,
+    "finished_at": fields.DateTime
+})
+
+# -----------------------------------------------------------------------------
+# Query parsers
+# -----------------------------------------------------------------------------
+STORE_PAGE_SIZE = int(os.environ.get("STORE_PAGE_SIZE", 100))
+STORE_PAGE_SIZE_MAX = 1000
+
+store_list_parser = reqparse.RequestParser()
+store_list_parser.add_argument(
+    "limit", type=inputs.int_range(1, STORE_PAGE_SIZE_MAX), location="args",
+    help=f"Page size (1-{STORE_PAGE_SIZE_MAX}, default {STORE_PAGE_SIZE})"
+)
+store_list_parser.add_argument(
+    "after", type=inputs.natural, location="args",
+    help="Cursor from the X-Next-Cursor header of the previous page"
+)
+
+STORE_FIELDS = ("name", "items", "item_count")
+STORE_EMBED_FIELD = {"items": "items", "count": "item_count", "none": None}
+
+
+def store_fields(value):
+    requested = {f.strip() for f in value.split(",") if f.strip()}
+    unknown = requested - set(STORE_FIELDS)
+    if not requested or unknown:
+        raise ValueError(f"fields must be a comma-separated subset of {', '.join(STORE_FIELDS)}")
+    return requested
+
+
+store_list_parser.add_argument(
+    "fields", type=store_fields, location="args",
+    help=f"Comma-separated fields to return ({', '.join(STORE_FIELDS)})"
+)
+store_list_parser.add_argument(
+    "embed", choices=tuple(STORE_EMBED_FIELD), location="args",
+    help="How to include items: full list, count only or not at all (default follows `fields`, else items)"
+)
+
+
+def resolve_store_fields(requested, embed):
+    """Work out which keys to return and how items have to be loaded."""
+    if embed is None:
+        if requested is None or "items" in requested:
+            embed = "items"
+        elif "item_count" in requested:
+            embed = "count"
+        else:
+            embed = "none"
+    available = {"name", STORE_EMBED_FIELD[embed]} - {None}
+    if requested is None:
+        return available, embed
+    if not requested & available:
+        raise ValueError(f"embed={embed} returns none of the requested fields")
+    return requested & available, embed
+
+
+ITEM_PAGE_SIZE = int(os.environ.get("ITEM_PAGE_SIZE", 100))
+
+item_page_parser = reqparse.RequestParser()
+item_page_parser.add_argument(
+    "limit", type=inputs.int_range(1, STORE_PAGE_SIZE_MAX), location="args",
+    help=f"Items per page (1-{STORE_PAGE_SIZE_MAX}, default {ITEM_PAGE_SIZE})"
+)
+item_page_parser.add_argument(
+    "after", type=inputs.natural, location="args",
+    help="Cursor from the X-Next-Cursor header of the previous page"
+)
+
+item_search_parser = reqparse.RequestParser()
+item_search_parser.add_argument(
+    "cidr", type=parse_cidr, location="args", required=True,
+    help="IPv4 or IPv6 prefix, e.g. 10.20.0.0/16"
+)
+item_search_parser.add_argument(
+    "limit", type=inputs.int_range(1, STORE_PAGE_SIZE_MAX), location="args",
+    help=f"Items per page (1-{STORE_PAGE_SIZE_MAX}, default {ITEM_PAGE_SIZE})"
+)
+item_search_parser.add_argument(
+    "after", location="args",
+    help="Cursor from the X-Next-Cursor header of the previous page"
+)
+
 # -----------------------------------------------------------------------------
 # Authentication / Authorization
 # -----------------------------------------------------------------------------
@@ -193,18 +973,77 @@ def welcome():
     return {"message": "Welcome to Core API"}, 200
 # STORE ENDPOINTS
 # -----------------------------------------------------------------------------
+# Paths of collection endpoints that GET /store/<name> could never reach.
+RESERVED_STORE_NAMES = {"stats", "export.ndjson"}
+RESERVED_NAME_MESSAGE = f"store name is reserved ({', '.join(sorted(RESERVED_STORE_NAMES))})"
+
+
 @store_ns.route("/")
 class StoreList(Resource):
     @require_role("reader")
-    @store_ns.marshal_list_with(store_model)
-    @store_ns.doc(description="Get all stores (reader or higher)")
+    @etag_on_catalog_version
+    @cached_response("stores")
+    @store_ns.expect(store_list_parser)
+    @store_ns.response(200, "Success", [store_summary_model])
+    @store_ns.header("X-Next-Cursor", "Cursor for the next page (absent on the last page)")
+    @store_ns.doc(
+        description="Get stores one page at a time, ordered by id (reader or higher). "
+                    "Pass the X-Next-Cursor response header as `after` to fetch the next page. "
+                    "`fields`/`embed` trim the response and the query behind it."
+    )
     def get(self):
-        stores = Store.query.all()
-        return [s.to_dict() for s in stores]
+        args = store_list_parser.parse_args()
+        limit = args["limit"] or STORE_PAGE_SIZE
+        try:
+            keys, embed = resolve_store_fields(args["fields"], args["embed"])
+        except ValueError as exc:
+            return {"message": str(exc)}, 400
+
+        # Keyset pagination on the primary key. Items are only touched when
+        # asked for: one IN (...) query for the page's items, a GROUP BY for
+        # counts, and no item query at all otherwise.
+        if embed == "count":
+            query = (
+                db.session.query(Store.id, Store.name, func.count(Item.id).label("item_count"))
+                .outerjoin(Item, Item.store_id == Store.id)
+                .group_by(Store.id)
+            )
+        else:
+            query = db.session.query(Store.id, Store.name)
+        query = query.order_by(Store.id)
+        if args["after"] is not None:
+            query = query.filter(Store.id > args["after"])
+        rows = query.limit(limit + 1).all()
+
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = str(rows[-1].id)
+
+        stores, items_by_store = [], {}
+        for row in rows:
+            store = {}
+            if "name" in keys:
+                store["name"] = row.name
+            if "items" in keys:
+                store["items"] = items_by_store[row.id] = []
+            if "item_count" in keys:
+                store["item_count"] = row.item_count
+            stores.append(store)
+        if items_by_store:
+            item_rows = db.session.execute(
+                select(Item.store_id, Item.name, Item.ip)
+                .where(Item.store_id.in_(items_by_store))
+                .order_by(Item.id)
+            )
+            for store_id, item_name, ip in item_rows:
+                items_by_store[store_id].append({"name": item_name, "ip": ip})
+        return json_response(stores, headers=headers)
 
     @require_role("writer")
+    @idempotent
     @store_ns.expect(store_create_model)
-    @store_ns.marshal_with(store_model, code=201)
+    @store_ns.response(201, "Created", store_model)
     @store_ns.doc(description="Create a new store (writer or higher)")
     def post(self):
         data = request.get_json() or {}
@@ -212,80 +1051,896 @@ class StoreList(Resource):
 
         if not name:
             return {"message": "name required"}, 400
-        if Store.query.filter_by(name=name).first():
+        if name in RESERVED_STORE_NAMES:
+            return {"message": RESERVED_NAME_MESSAGE}, 400
+
+        # The unique constraint decides, so two replicas racing on the same
+        # name cannot both succeed and no SELECT is needed first.
+        created = db.session.execute(
+            insert_stmt(Store).values(name=name)
+            .on_conflict_do_nothing(index_elements=["name"])
+            .returning(Store.id)
+        ).scalar()
+        if created is None:
+            db.session.rollback()
             return {"message": "store exists"}, 400
 
-        new_store = Store(name=name)
-        db.session.add(new_store)
+        version = bump_catalog_version()
         db.session.commit()
-        return new_store.to_dict(), 201
+        invalidate_reads(name)
+        ip_index.apply(version)
+        return marshal({"name": name, "items": []}, store_model), 201
+
+
+# Holds the stats of the latest version seen only.
+catalog_stats_memo = {}
+_catalog_stats_lock = threading.Lock()
+
+
+def catalog_stats(version):
+    """
+    Aggregate counts for `version`, computed with GROUP BY in the database and
+    memoized until the catalog version moves (on this or any other replica).
+    """
+    with _catalog_stats_lock:
+        if version in catalog_stats_memo:
+            return catalog_stats_memo[version]
+
+    per_store = db.session.execute(
+        select(Store.name, func.count(Item.id), func.count(func.distinct(Item.ip)))
+        .outerjoin(Item, Item.store_id == Store.id)
+        .group_by(Store.id)
+        .order_by(Store.id)
+    ).all()
+    total_items, distinct_ips = db.session.execute(
+        select(func.count(Item.id), func.count(func.distinct(Item.ip)))
+    ).one()
+    data = {
+        "version": version,
+        "total_stores": len(per_store),
+        "total_items": total_items,
+        "distinct_ips": distinct_ips,
+        "stores": [{"name": n, "item_count": c, "distinct_ips": d} for n, c, d in per_store],
+    }
+    with _catalog_stats_lock:
+        catalog_stats_memo.clear()
+        catalog_stats_memo[version] = data
+    return data
+
+
+@store_ns.route("/bulk")
+class StoreBulkCreate(Resource):
+    BULK_MAX = 5000
+    INSERT_CHUNK = 500
+
+    @require_role("writer")
+    @idempotent
+    @store_ns.expect([store_create_model])
+    @store_ns.response(200, "Success", store_bulk_summary_model)
+    @store_ns.doc(description=f"Create up to {BULK_MAX} stores in one transaction (writer or higher)")
+    def post(self):
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return {"message": "a JSON array of stores is required"}, 400
+        if len(data) > self.BULK_MAX:
+            return {"message": f"at most {self.BULK_MAX} stores per request"}, 400
+
+        names = []
+        for entry in data:
+            name = entry.get("name") if isinstance(entry, dict) else None
+            valid = isinstance(name, str) and name and name not in RESERVED_STORE_NAMES
+            names.append(name if valid else None)
+        unique = list(dict.fromkeys(n for n in names if n))
+
+        # Multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING: names that
+        # already exist (including ones another replica inserted a moment
+        # ago) are skipped by the unique constraint instead of pre-checked.
+        created = set()
+        for start in range(0, len(unique), self.INSERT_CHUNK):
+            chunk = unique[start:start + self.INSERT_CHUNK]
+            stmt = (
+                insert_stmt(Store)
+                .values([{"name": n} for n in chunk])
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(Store.name)
+            )
+            created.update(db.session.execute(stmt).scalars())
+
+        version = None
+        if created:
+            version = bump_catalog_version()
+        db.session.commit()
+        if created:
+            invalidate_reads(*created)
+            ip_index.apply(version)
+
+        results, seen = [], set()
+        for entry, name in zip(data, names):
+            if name is None:
+                results.append({"name": entry.get("name") if isinstance(entry, dict) else None,
+                                "status": "invalid"})
+            elif name in created and name not in seen:
+                results.append({"name": name, "status": "created"})
+            else:
+                results.append({"name": name, "status": "duplicate"})
+            seen.add(name)
+        counts = {status: sum(r["status"] == status for r in results)
+                  for status in ("created", "duplicate", "invalid")}
+        return marshal({**counts, "results": results}, store_bulk_summary_model), 200
+
+
+@store_ns.route("/stats")
+class StoreStats(Resource):
+    @require_role("reader")
+    @etag_on_catalog_version
+    @store_ns.marshal_with(catalog_stats_model)
+    @store_ns.doc(description="Item counts per store and catalog totals (reader or higher)")
+    def get(self):
+        return catalog_stats(catalog_version())
+
+
+@store_ns.route("/export.ndjson")
+class StoreExport(Resource):
+    EXPORT_BATCH_SIZE = 1000
+
+    @require_role("reader")
+    @etag_on_catalog_version
+    @store_ns.produces(["application/x-ndjson"])
+    @store_ns.doc(description="Stream every store with its items, one JSON object per line (reader or higher)")
+    def get(self):
+        # One ordered outer join walked with a server-side cursor: rows are
+        # fetched in batches and grouped per store, so memory stays flat and
+        # the first line is sent before the whole catalog has been read.
+        stmt = (
+            select(Store.id, Store.name, Item.name, Item.ip)
+            .outerjoin(Item, Item.store_id == Store.id)
+            .order_by(Store.id, Item.id)
+            .execution_options(yield_per=self.EXPORT_BATCH_SIZE)
+        )
+
+        def generate():
+            rows = db.session.execute(stmt)
+            for (_, store_name), group in itertools.groupby(rows, key=lambda r: (r[0], r[1])):
+                items = [{"name": r[2], "ip": r[3]} for r in group if r[2] is not None]
+                yield json_dumps({"name": store_name, "items": items}) + b"\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 
 @store_ns.route("/<string:name>/item")
 class ItemCreate(Resource):
     @require_role("writer")
+    @idempotent
     @store_ns.expect(item_create_model)
-    @store_ns.marshal_with(item_model, code=201)
+    @store_ns.response(201, "Created", item_model)
     @store_ns.doc(description="Create an item inside a store (writer or higher)")
     def post(self, name):
         data = request.get_json() or {}
-
-        store = Store.query.filter_by(name=name).first()
-        if not store:
-            return {"message": "store not found"}, 404
-
         item_name = data.get("name")
         ip = data.get("ip")
 
         if not item_name or not ip:
             return {"message": "name and ip required"}, 400
 
-        new_item = Item(name=item_name, ip=ip, store=store)
-        db.session.add(new_item)
+        if item_group_commit is not None:
+            version = item_group_commit.submit((name, item_name, ip)).result()
+            if version is None:
+                return {"message": "store not found"}, 404
+            g.catalog_version = version
+            return marshal({"name": item_name, "ip": ip}, item_model), 201
+
+        if insert_item(name, item_name, ip) is None:
+            db.session.rollback()
+            return {"message": "store not found"}, 404
+
+        version = bump_catalog_version()
+        db.session.commit()
+        invalidate_reads(name)
+        ip_index.apply(version, ip_index.add, name, item_name, ip)
+        return marshal({"name": item_name, "ip": ip}, item_model), 201
+
+
+def insert_item(store_name, item_name, ip):
+    """
+    INSERT ... SELECT resolving the store in the same statement. Returns the
+    new item id, or None when the store does not exist.
+    """
+    ip_bin, ip_bin_end = ip_range_to_bin(ip)
+    return db.session.execute(
+        Item.__table__.insert()
+        .from_select(
+            ["name", "ip", "ip_bin", "ip_bin_end", "store_id"],
+            select(
+                literal(item_name, db.String),
+                literal(ip, db.String),
+                literal(ip_bin, db.LargeBinary),
+                literal(ip_bin_end, db.LargeBinary),
+                Store.id,
+            ).where(Store.name == store_name),
+        )
+        .returning(Item.__table__.c.id)
+    ).scalar()
+
+# -----------------------------------------------------------------------------
+# Group commit for item creation (opt-in: ITEM_GROUP_COMMIT=1)
+# -----------------------------------------------------------------------------
+item_group_commit = None
+
+
+def apply_item_batch(payloads):
+    """
+    Insert a batch of (store, item, ip) in one transaction. Returns, per
+    item, the catalog version it was committed in, or None if its store
+    does not exist.
+    """
+    with app.app_context():
+        try:
+            inserted = [insert_item(*payload) is not None for payload in payloads]
+            created = [payload for payload, ok in zip(payloads, inserted) if ok]
+            version = bump_catalog_version() if created else None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if created:
+            invalidate_reads(*{store for store, _, _ in created})
+            ip_index.apply(version, ip_index.add_many, created)
+        return [version if ok else None for ok in inserted]
+
+
+def enable_item_group_commit(max_batch=64, max_wait=0.002):
+    """
+    Route ItemCreate.post through a single writer thread that commits
+    concurrent requests together; each request is answered once its batch
+    has committed.
+    """
+    global item_group_commit
+    item_group_commit = GroupCommitter(apply_item_batch, max_batch=max_batch, max_wait=max_wait,
+                                       name="item-group-commit")
+    return item_group_commit
+
+
+def disable_item_group_commit():
+    global item_group_commit
+    committer, item_group_commit = item_group_commit, None
+    if committer is not None:
+        committer.close()
+
+
+# -----------------------------------------------------------------------------
+# Single writer for replicas sharing one SQLite file (opt-in: WRITE_COORDINATOR=1)
+# -----------------------------------------------------------------------------
+# One process, elected through a lock file in the instance folder, applies
+# every write; the others forward theirs over a Unix socket, so processes no
+# longer contend for SQLite's write lock. Reads are answered locally.
+WRITE_COORDINATOR_LOCK = os.environ.get(
+    "WRITE_COORDINATOR_LOCK", os.path.join(app.instance_path, "writer.lock"))
+WRITE_COORDINATOR_SOCKET = os.environ.get(
+    "WRITE_COORDINATOR_SOCKET", os.path.join(app.instance_path, "writer.sock"))
+# POSTs that only read.
+WRITE_FORWARD_EXEMPT = {"auth_login", "lookup_ip_lookup_batch"}
+write_coordinator = None
+
+
+@app.before_request
+def forward_writes():
+    if (write_coordinator is None or request.method in READ_METHODS
+            or request.endpoint in WRITE_FORWARD_EXEMPT or not write_coordinator.should_forward(request)):
+        return None
+    return write_coordinator.forward(request)
+
+
+def enable_write_coordinator(lock_path=WRITE_COORDINATOR_LOCK, socket_path=WRITE_COORDINATOR_SOCKET,
+                             timeout=60):
+    global write_coordinator
+    write_coordinator = WriteCoordinator(app, lock_path, socket_path, timeout=timeout)
+    write_coordinator.start()
+    return write_coordinator
+
+
+def disable_write_coordinator():
+    global write_coordinator
+    coordinator, write_coordinator = write_coordinator, None
+    if coordinator is not None:
+        coordinator.stop()
+
+
+def parse_item_stream(stream, content_type):
+    """
+    Yield (line number, name, ip, error) for each record of an NDJSON or CSV
+    (header: name,ip) body, reading it incrementally.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if content_type == "text/csv":
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or not {"name", "ip"} <= set(reader.fieldnames):
+            yield 1, None, None, "CSV header must contain name and ip"
+            return
+        records = ((reader.line_num, row) for row in reader)
+    else:
+        def ndjson():
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+        records = ndjson()
+
+    for number, record in records:
+        if not isinstance(record, dict):
+            yield number, None, None, "not a JSON object"
+            continue
+        name, ip = record.get("name"), record.get("ip")
+        if not isinstance(name, str) or not name.strip():
+            yield number, None, None, "name required"
+        elif not isinstance(ip, str) or to_mapped_network(ip) is None:
+            yield number, None, None, "ip must be an IP address or prefix"
+        else:
+            yield number, name, ip.strip(), None
+
+
+ITEM_IMPORT_CHUNK_SIZE = 1000
+ITEM_IMPORT_MAX_ERRORS = 100
+
+
+def current_store_name(store_id):
+    """
+    A store's name for the caches and IP index a write updates. Read it
+    after bump_catalog_version(): a rename that committed earlier is then
+    seen, and one that commits later also applies later.
+    """
+    return db.session.execute(select(Store.name).where(Store.id == store_id)).scalar()
+
+
+def import_item_stream(store_id, stream, content_type, progress=None, skip=0):
+    """
+    Validate and insert the items of an NDJSON/CSV stream into a store;
+    returns the import summary. `progress(rows_read)` is called inside each
+    chunk's transaction, just before its commit. The first `skip` rows are
+    validated and counted but not inserted (a resumed import).
+    """
+    accepted, rejected, errors = 0, 0, []
+    chunk = []
+
+    # Only one chunk of rows is held at a time; each chunk is one bulk
+    # insert (COPY on PostgreSQL) in its own transaction, so readers see
+    # progress and the writer lock is released between chunks.
+    def flush():
+        bulk_insert_items([(n, ip, store_id) for n, ip in chunk])
+        version = bump_catalog_version()
+        name = current_store_name(store_id)
+        if progress is not None:
+            progress(accepted + rejected)
         db.session.commit()
-        return new_item.to_dict(), 201
+        invalidate_reads(name)
+        ip_index.apply(version, ip_index.add_many, [(name, n, ip) for n, ip in chunk])
+        chunk.clear()
+
+    for number, item_name, ip, error in parse_item_stream(stream, content_type):
+        if error:
+            rejected += 1
+            if len(errors) < ITEM_IMPORT_MAX_ERRORS:
+                errors.append({"line": number, "message": error})
+            continue
+        accepted += 1
+        if accepted + rejected <= skip:
+            continue
+        chunk.append((item_name, ip))
+        if len(chunk) >= ITEM_IMPORT_CHUNK_SIZE:
+            flush()
+    if chunk:
+        flush()
+
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+    }
+
+
+item_import_parser = reqparse.RequestParser()
+item_import_parser.add_argument(
+    "mode", choices=("foreground", "background"), default="foreground", location="args",
+    help="background: spool the body, answer 202 with a job and import it afterwards"
+)
+
+
+@store_ns.route("/<string:name>/items/bulk")
+class ItemBulkImport(Resource):
+    CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "text/csv")
+
+    @require_role("writer")
+    @idempotent
+    @store_ns.expect(item_import_parser)
+    @store_ns.doc(
+        description="Stream items into a store as NDJSON or CSV (name,ip); rows are validated "
+                    "as they are read and inserted in committed chunks (writer or higher)",
+        consumes=list(CONTENT_TYPES),
+    )
+    @store_ns.response(200, "Success", item_import_summary_model)
+    @store_ns.response(202, "Import job queued (mode=background)", job_model)
+    def post(self, name):
+        args = item_import_parser.parse_args()
+        if request.mimetype not in self.CONTENT_TYPES:
+            return {"message": f"Content-Type must be one of {', '.join(self.CONTENT_TYPES)}"}, 415
+        store_id = db.session.execute(select(Store.id).where(Store.name == name)).scalar()
+        if store_id is None:
+            return {"message": "store not found"}, 404
+
+        if args["mode"] == "background":
+            job_id = new_job_id()
+            with open(job_file(job_id, "upload"), "wb") as spool:
+                shutil.copyfileobj(request.stream, spool)
+            return submit_job("import_items", {
+                "store": name, "store_id": store_id, "content_type": request.mimetype,
+            }, job_id=job_id)
+
+        summary = import_item_stream(store_id, request.stream, request.mimetype)
+        return marshal(summary, item_import_summary_model), 200
+
+
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", 5000))
+
+store_delete_parser = reqparse.RequestParser()
+store_delete_parser.add_argument(
+    "mode", choices=("foreground", "background"), default="foreground", location="args",
+    help="background: answer 202 at once and delete the items in batches afterwards"
+)
+
+def store_deleted(name=None, store_id=None):
+    """
+    Bump the version, commit a store's deletion and update caches/index.
+    Pass `store_id` instead of the name when it may have changed since it
+    was read, as in a background job.
+    """
+    version = bump_catalog_version()
+    if store_id is not None:
+        name = current_store_name(store_id)
+    db.session.commit()
+    invalidate_reads(name)
+    ip_index.apply(version, ip_index.remove_store, name)
+
+
+def delete_store_in_batches(store_id, batch_size=None, progress=None):
+    """
+    Delete a store's items DELETE_BATCH_SIZE rows per transaction, then the
+    store itself, so the writer lock is never held for the whole store.
+    `progress(items_deleted)` is called after each committed batch.
+    """
+    batch_size = batch_size or DELETE_BATCH_SIZE
+    deleted = 0
+    while True:
+        batch = select(Item.id).where(Item.store_id == store_id).limit(batch_size).scalar_subquery()
+        removed = db.session.execute(delete(Item).where(Item.id.in_(batch))).rowcount
+        if not removed:
+            break
+        store_deleted(store_id=store_id)
+        deleted += removed
+        if progress is not None:
+            progress(deleted)
+    name = db.session.execute(delete(Store).where(Store.id == store_id).returning(Store.name)).scalar()
+    if name is None:
+        # Deleted meanwhile by a foreground DELETE, which updated the caches.
+        db.session.rollback()
+        return
+    store_deleted(name)
 
 
 @store_ns.route("/<string:name>")
 class StoreOperations(Resource):
+    @require_role("reader")
+    @etag_on_catalog_version
+    @cached_response("store:{name}")
+    @store_ns.expect(item_page_parser)
+    @store_ns.response(200, "Success", store_summary_model)
+    @store_ns.header("X-Next-Cursor", "Cursor for the next page of items (absent on the last page)")
+    @store_ns.doc(description="Get one store with a page of its items and its item count (reader or higher)")
+    def get(self, name):
+        args = item_page_parser.parse_args()
+        store_id = db.session.execute(select(Store.id).where(Store.name == name)).scalar()
+        if store_id is None:
+            return {"message": "store not found"}, 404
+        return self._store_page(store_id, name, args)
+
+    @staticmethod
+    def _store_page(store_id, name, args, status=200):
+        """The store with its item count and one keyset page of items."""
+        limit = args["limit"] or ITEM_PAGE_SIZE
+        query = select(Item.id, Item.name, Item.ip).where(Item.store_id == store_id).order_by(Item.id)
+        if args["after"] is not None:
+            query = query.where(Item.id > args["after"])
+        items = db.session.execute(query.limit(limit + 1)).all()
+        item_count = db.session.execute(
+            select(func.count(Item.id)).where(Item.store_id == store_id)
+        ).scalar()
+
+        headers = {}
+        if len(items) > limit:
+            items = items[:limit]
+            headers["X-Next-Cursor"] = str(items[-1].id)
+        data = {"name": name, "items": [{"name": i.name, "ip": i.ip} for i in items], "item_count": item_count}
+        return json_response(data, status=status, headers=headers)
+
     @require_role("admin")
-    @store_ns.doc(description="Delete a store (admin only)")
+    @idempotent
+    @store_ns.expect(store_delete_parser)
+    @store_ns.response(202, "Deletion job queued (mode=background)", job_model)
+    @store_ns.doc(description="Delete a store and its items (admin only)")
     def delete(self, name):
-        store = Store.query.filter_by(name=name).first()
-        if not store:
-            return {"message": "Store not found"}, 404
+        args = store_delete_parser.parse_args()
+        if args["mode"] == "background":
+            store_id = db.session.execute(select(Store.id).where(Store.name == name)).scalar()
+            if store_id is None:
+                return {"message": "Store not found"}, 404
+            return submit_job("delete_store", {"store": name, "store_id": store_id})
 
-        db.session.delete(store)
-        db.session.commit()
+        # A single DELETE; the database cascades to the store's items.
+        deleted = db.session.execute(delete(Store).where(Store.name == name).returning(Store.id)).scalar()
+        if deleted is None:
+            db.session.rollback()
+            return {"message": "Store not found"}, 404
+        store_deleted(name)
         return {"message": "Store deleted"}, 200
 
     @require_role("writer")
-    @store_ns.doc(description="Rename a store (writer or higher)")
+    @idempotent
+    @store_ns.expect(store_create_model, item_page_parser)
+    @store_ns.response(200, "Success", store_summary_model)
+    @store_ns.header("X-Next-Cursor", "Cursor for the next page of items (absent on the last page)")
+    @store_ns.doc(description="Rename a store; returns it with its item count and first page of items "
+                              "(writer or higher)")
     def put(self, name):
+        # Parsed before the UPDATE, so a bad page argument cannot fail the
+        # request after the rename has committed.
+        page_args = item_page_parser.parse_args()
         data = request.get_json() or {}
         new_name = data.get("name")
 
         if not new_name:
             return {"message": "new name required"}, 400
+        if new_name in RESERVED_STORE_NAMES:
+            return {"message": RESERVED_NAME_MESSAGE}, 400
+        if new_name == name:
+            return {"message": "a store with the new name already exists"}, 400
 
-        store = Store.query.filter_by(name=name).first()
-        if not store:
-            return {"message": "store not found"}, 404
-
-        if Store.query.filter_by(name=new_name).first():
+        # One UPDATE ... RETURNING; the unique constraint rejects a taken name.
+        try:
+            store_id = db.session.execute(
+                update(Store).where(Store.name == name).values(name=new_name).returning(Store.id)
+            ).scalar()
+        except IntegrityError:
+            db.session.rollback()
             return {"message": "a store with the new name already exists"}, 400
+        if store_id is None:
+            db.session.rollback()
+            return {"message": "store not found"}, 404
 
-        store.name = new_name
+        version = bump_catalog_version()
         db.session.commit()
+        invalidate_reads(name, new_name)
+        ip_index.apply(version, ip_index.rename_store, name, new_name)
+
+        # Never loads the full item list: a count plus one page at most.
+        return self._store_page(store_id, new_name, page_args)
+
+
+@store_ns.route("/<string:name>/item/<string:item_name>")
+class ItemDetail(Resource):
+    @require_role("reader")
+    @etag_on_catalog_version
+    @cached_response("store:{name}")
+    @store_ns.response(200, "Success", item_model)
+    @store_ns.doc(description="Get an item of a store by name; the oldest one if the name repeats (reader or higher)")
+    def get(self, name, item_name):
+        item = (
+            Item.query.join(Store, Item.store_id == Store.id)
+            .filter(Store.name == name, Item.name == item_name)
+            .order_by(Item.id)
+            .first()
+        )
+        if not item:
+            return {"message": "item not found"}, 404
+        return json_response(item.to_dict())
+
+# -----------------------------------------------------------------------------
+# ITEM ENDPOINTS
+# -----------------------------------------------------------------------------
+@item_ns.route("/")
+class ItemSearch(Resource):
+    @require_role("reader")
+    @etag_on_catalog_version
+    @cached_response("stores")
+    @item_ns.expect(item_search_parser)
+    @item_ns.response(200, "Success", [item_location_model])
+    @item_ns.header("X-Next-Cursor", "Cursor for the next page (absent on the last page)")
+    @item_ns.doc(description="Find items whose IP or prefix overlaps a CIDR prefix, in address order "
+                             "(reader or higher)")
+    def get(self):
+        args = item_search_parser.parse_args()
+        limit = args["limit"] or ITEM_PAGE_SIZE
+        low, high = cidr_range(args["cidr"])
+        after = None
+        if args["after"]:
+            try:
+                cursor_ip, cursor_id = args["after"].split(":")
+                after = (bytes.fromhex(cursor_ip), int(cursor_id))
+            except ValueError:
+                return {"message": "invalid cursor"}, 400
+
+        # (ip_bin, id) is the keyset cursor; ip_bin is a prefix's first address.
+        def page(condition, size):
+            query = (
+                db.session.query(Item.id, Item.name, Item.ip, Item.ip_bin, Store.name.label("store"))
+                .join(Store, Item.store_id == Store.id)
+                .filter(condition)
+                .order_by(Item.ip_bin, Item.id)
+            )
+            if after is not None:
+                query = query.filter(tuple_(Item.ip_bin, Item.id) > after)
+            return query.limit(size).all()
+
+        # Two prefixes are either nested or disjoint, so an overlapping item
+        # contains the searched prefix, and starts at one of its few supernet
+        # addresses (all before `low`), or lies inside it: a range scan on the
+        # ip_bin index.
+        rows = []
+        starts = supernet_starts(args["cidr"])
+        if starts and (after is None or after[0] < low):
+            rows = page(Item.ip_bin.in_(starts) & (Item.ip_bin_end >= high), limit + 1)
+        if len(rows) <= limit:
+            rows += page(Item.ip_bin.between(low, high), limit + 1 - len(rows))
+
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = f"{rows[-1].ip_bin.hex()}:{rows[-1].id}"
+        data = [{"name": r.name, "ip": r.ip, "store": r.store} for r in rows]
+        return json_response(data, headers=headers)
+
+# -----------------------------------------------------------------------------
+# LOOKUP ENDPOINTS
+# -----------------------------------------------------------------------------
+IP_LOOKUP_BATCH_MAX = 10000
+
+ip_owner_model = lookup_ns.model("IPOwner", {
+    "store": fields.String,
+    "item": fields.String,
+    "ip": fields.String
+})
+
+ip_lookup_model = lookup_ns.model("IPLookup", {
+    "ip": fields.String,
+    "prefix": fields.String,
+    "owners": fields.List(fields.Nested(ip_owner_model))
+})
+
+ip_batch_model = lookup_ns.model("IPLookupBatch", {
+    "ips": fields.List(fields.String, required=True)
+})
+
+
+def lookup_ip(address):
+    match = ip_index.lookup(address) or {"prefix": None, "owners": []}
+    return {"ip": address, **match}
+
+
+@lookup_ns.route("/ip/<string:address>")
+class IPLookup(Resource):
+    @require_role("reader")
+    @lookup_ns.response(200, "Success", ip_lookup_model)
+    @lookup_ns.doc(description="Which items/stores own this IP, by longest prefix match (reader or higher)")
+    def get(self, address):
+        # Lookups never touch the database: a stale index keeps answering
+        # while the refresher rebuilds it.
+        if ip_index.stale:
+            wake_ip_index_refresher()
+        try:
+            result = lookup_ip(address)
+        except ValueError:
+            return {"message": "invalid ip"}, 400
+        if not result["owners"]:
+            return {"message": "no owner for ip", "ip": address}, 404
+        return result, 200
+
+
+@lookup_ns.route("/ip")
+class IPLookupBatch(Resource):
+    @require_role("reader")
+    @lookup_ns.expect(ip_batch_model)
+    @lookup_ns.response(200, "Success", [ip_lookup_model])
+    @lookup_ns.doc(description=f"Look up to {IP_LOOKUP_BATCH_MAX} IPs at once (reader or higher)")
+    def post(self):
+        data = request.get_json() or {}
+        ips = data.get("ips")
+        if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+            return {"message": "ips must be a list of strings"}, 400
+        if len(ips) > IP_LOOKUP_BATCH_MAX:
+            return {"message": f"at most {IP_LOOKUP_BATCH_MAX} ips per request"}, 400
+
+        if ip_index.stale:
+            wake_ip_index_refresher()
+        results = []
+        for ip in ips:
+            try:
+                results.append(lookup_ip(ip))
+            except ValueError:
+                results.append({"ip": ip, "error": "invalid ip"})
+        return results, 200
+
+# -----------------------------------------------------------------------------
+# CACHE ENDPOINTS
+# -----------------------------------------------------------------------------
+@cache_ns.route("/stats")
+class CacheStats(Resource):
+    @require_role("admin")
+    @cache_ns.doc(description="Response cache size and hit/miss counters (admin only)")
+    def get(self):
+        return response_cache.stats(), 200
+
+# -----------------------------------------------------------------------------
+# JOB ENDPOINTS
+# -----------------------------------------------------------------------------
+# Long operations run as persisted jobs on a small worker pool: the request
+# that starts one answers 202 with the job, and clients poll /api/jobs/<id>.
+# Uploads and results live in JOB_DIR (default instance/jobs), which replicas
+# share like the database, so any replica can serve a job's status and result.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(app.instance_path, "jobs"))
+os.makedirs(JOB_DIR, exist_ok=True)
+EXPORT_JOB_PAGE_SIZE = 500
+
+# Kinds that POST /api/jobs may start, with the role each one needs.
+# import_items jobs are started by POST /api/store/<name>/items/bulk?mode=background.
+JOB_KIND_ROLES = {"export": "reader", "delete_store": "admin"}
+
+job_runner = JobRunner(app, db, Job, workers=JOB_WORKERS)
+
+
+def job_file(job_id, suffix):
+    return os.path.join(JOB_DIR, f"{job_id}.{suffix}")
+
 
-        refreshed = Store.query.get(store.id)
-        return refreshed.to_dict(), 200
+def submit_job(kind, params, job_id=None):
+    """Queue a job for the current user and answer 202 pointing at it."""
+    job = job_runner.submit(kind, params, user=g.current_user, job_id=job_id)
+    return marshal(job.to_dict(), job_model), 202, {"Location": f"/api/jobs/{job.id}"}
+
+
+def export_job(ctx):
+    """Write every store with its items to an NDJSON file, one page of stores per transaction."""
+    total = db.session.execute(select(func.count(Store.id))).scalar()
+    ctx.progress(0, total)
+    path = job_file(ctx.job_id, "ndjson")
+    exported, after = 0, 0
+    with open(path + ".part", "wb") as out:
+        while True:
+            stores = db.session.execute(
+                select(Store.id, Store.name).where(Store.id > after).order_by(Store.id)
+                .limit(EXPORT_JOB_PAGE_SIZE)
+            ).all()
+            if not stores:
+                break
+            items = {store_id: [] for store_id, _ in stores}
+            for store_id, item_name, ip in db.session.execute(
+                select(Item.store_id, Item.name, Item.ip).where(Item.store_id.in_(items)).order_by(Item.id)
+            ):
+                items[store_id].append({"name": item_name, "ip": ip})
+            for store_id, store_name in stores:
+                out.write(json_dumps({"name": store_name, "items": items[store_id]}) + b"\n")
+            exported += len(stores)
+            after = stores[-1].id
+            ctx.progress(exported)
+    os.replace(path + ".part", path)
+    ctx.result_location = f"/api/jobs/{ctx.job_id}/result"
+    return {"stores": exported, "bytes": os.path.getsize(path)}
+
+
+def delete_store_job(ctx):
+    store_id = ctx.params["store_id"]
+    total = db.session.execute(select(func.count(Item.id)).where(Item.store_id == store_id)).scalar()
+    ctx.progress(0, total)
+    delete_store_in_batches(store_id, progress=ctx.progress)
+    return {"deleted": True}
+
+
+def import_items_job(ctx):
+    # Progress is recorded with each chunk, so a resumed job skips exactly
+    # the rows that were committed.
+    try:
+        with open(job_file(ctx.job_id, "upload"), "rb") as body:
+            return import_item_stream(ctx.params["store_id"], body,
+                                      ctx.params["content_type"], skip=ctx.resume_from,
+                                      progress=lambda done: ctx.progress(done, commit=False))
+    finally:
+        remove_job_upload(ctx.job_id)
+
+
+def remove_job_upload(job_id):
+    try:
+        os.remove(job_file(job_id, "upload"))
+    except FileNotFoundError:
+        pass
+
+
+job_runner.register("export", export_job)
+job_runner.register("delete_store", delete_store_job)
+job_runner.register("import_items", import_items_job, cleanup=remove_job_upload)
+
+
+def visible_job(job_id):
+    """The job if the current user started it or is an admin, else None."""
+    # Jobs are written and updated on the primary, and a 202 carries no
+    # X-Catalog-Version to wait for: a lagging replica would answer 404 or
+    # stale progress to a client polling the job's Location.
+    g.read_from_primary = True
+    job = db.session.get(Job, job_id)
+    if job is None or (job.created_by != g.current_user and g.current_role != "admin"):
+        return None
+    return job
+
+
+@jobs_ns.route("")
+class JobList(Resource):
+    @require_role("reader")
+    @idempotent
+    @jobs_ns.expect(job_create_model)
+    @jobs_ns.response(202, "Job queued", job_model)
+    @jobs_ns.header("Location", "URL of the job status")
+    @jobs_ns.doc(description="Start a background job: export (reader or higher) or "
+                             'delete_store with params {"store": <name>} (admin only)')
+    def post(self):
+        data = request.get_json(silent=True) or {}
+        kind = data.get("kind")
+        params = data.get("params") or {}
+        if kind not in JOB_KIND_ROLES:
+            return {"message": f"kind must be one of {', '.join(JOB_KIND_ROLES)}"}, 400
+        if ROLE_HIERARCHY[g.current_role] < ROLE_HIERARCHY[JOB_KIND_ROLES[kind]]:
+            return {"message": "Forbidden: insufficient role"}, 403
+
+        if kind == "delete_store":
+            name = params.get("store") if isinstance(params, dict) else None
+            store_id = db.session.execute(select(Store.id).where(Store.name == name)).scalar()
+            if store_id is None:
+                return {"message": "store not found"}, 404
+            return submit_job(kind, {"store": name, "store_id": store_id})
+        return submit_job(kind, {})
+
+
+@jobs_ns.route("/<string:job_id>")
+class JobStatus(Resource):
+    @require_role("reader")
+    @jobs_ns.response(200, "Success", job_model)
+    @jobs_ns.doc(description="Status, progress and result of a job (its creator or an admin)")
+    def get(self, job_id):
+        job = visible_job(job_id)
+        if job is None:
+            return {"message": "job not found"}, 404
+        return marshal(job.to_dict(), job_model), 200
+
+
+@jobs_ns.route("/<string:job_id>/result")
+class JobResult(Resource):
+    @require_role("reader")
+    @jobs_ns.produces(["application/x-ndjson"])
+    @jobs_ns.doc(description="Download the file produced by a finished export job (its creator or an admin)")
+    def get(self, job_id):
+        job = visible_job(job_id)
+        if job is None:
+            return {"message": "job not found"}, 404
+        path = job_file(job_id, "ndjson")
+        if job.status != "succeeded" or not os.path.exists(path):
+            return {"message": "job has no result file"}, 404
+        return send_file(path, mimetype="application/x-ndjson", download_name=f"{job.kind}-{job_id}.ndjson")
 
 # -----------------------------------------------------------------------------
 # DEBUG ENDPOINT
 # -----------------------------------------------------------------------------
 @store_ns.route("/debug/list")
 class DebugStores(Resource):
+    @cached_response("stores")
     def get(self):
         stores = Store.query.all()
         return {"stores": [s.name for s in stores]}
@@ -293,12 +1948,107 @@ class DebugStores(Resource):
 # -----------------------------------------------------------------------------
 # Initialize DB
 # -----------------------------------------------------------------------------
+def upgrade_item_fk_cascade():
+    """
+    Rebuild the item table on SQLite databases created before store_id had
+    ON DELETE CASCADE (SQLite cannot alter a constraint in place).
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+    fks = db.session.execute(text("PRAGMA foreign_key_list(item)")).mappings().all()
+    db.session.commit()
+    if not fks or all(fk["on_delete"] == "CASCADE" for fk in fks):
+        return
+
+    columns = ", ".join(c.name for c in Item.__table__.columns)
+    script = ["BEGIN", "ALTER TABLE item RENAME TO item_old"]
+    script += [f"DROP INDEX IF EXISTS {index.name}" for index in Item.__table__.indexes]
+    script.append(str(CreateTable(Item.__table__).compile(db.engine)))
+    script.append(f"INSERT INTO item ({columns}) SELECT {columns} FROM item_old")
+    script.append("DROP TABLE item_old")
+    script += [str(CreateIndex(index).compile(db.engine)) for index in Item.__table__.indexes]
+    script.append("COMMIT")
+
+    raw = db.engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        conn.execute("PRAGMA foreign_keys=OFF")
+        conn.executescript(";\n".join(script) + ";")
+        conn.execute("PRAGMA foreign_keys=ON")
+    finally:
+        raw.close()
+
+
+def add_item_ip_bin(m):
+    m.add_column(Item.__table__.c.ip_bin)
+    m.create_index(next(i for i in Item.__table__.indexes if i.name == "ix_item_ip_bin"))
+
+
+def backfill_item_ip_bin(m):
+    m.backfill(Item.__table__.c.ip_bin, lambda row: ip_to_bin(row.ip), [Item.ip])
+
+
+def create_item_indexes(m):
+    for index in sorted(Item.__table__.indexes, key=lambda i: i.name):
+        m.create_index(index)
+
+
+def backfill_item_ip_ranges(m):
+    m.backfill(Item.__table__.c.ip_bin_end, lambda row: ip_range_to_bin(row.ip)[1], [Item.ip])
+    # Prefix items, left NULL by the ip_bin backfill, get their first address.
+    m.backfill(Item.__table__.c.ip_bin, lambda row: ip_range_to_bin(row.ip)[0], [Item.ip])
+
+
+def add_job_lease(m):
+    m.add_column(Job.__table__.c.lease_until)
+    m.add_column(Job.__table__.c.attempts)
+
+
+# create_all() makes missing tables in their current shape; migrations bring
+# tables made by older versions up to date. Never renumber or edit a shipped
+# migration: append a new one.
+MIGRATIONS = [
+    Migration(1, "add item.ip_bin", add_item_ip_bin, online=False),
+    Migration(2, "item.store_id ON DELETE CASCADE",
+              lambda m: m.run(upgrade_item_fk_cascade), online=False),
+    Migration(3, "backfill item.ip_bin", backfill_item_ip_bin, online=True),
+    Migration(4, "item indexes on store_id, ip and (store_id, name)", create_item_indexes, online=True),
+    Migration(5, "job.lease_until and job.attempts", add_job_lease, online=False),
+    Migration(6, "idempotency_key.catalog_version",
+              lambda m: m.add_column(IdempotencyKey.__table__.c.catalog_version), online=False),
+    Migration(7, "add item.ip_bin_end", lambda m: m.add_column(Item.__table__.c.ip_bin_end), online=False),
+    Migration(8, "backfill item ip ranges for prefixes", backfill_item_ip_ranges, online=True),
+]
+
+migrator = Migrator(
+    app, db, SchemaMigration, MIGRATIONS,
+    batch_size=int(os.environ.get("MIGRATION_BATCH_SIZE", 1000)),
+    batch_pause=float(os.environ.get("MIGRATION_BATCH_PAUSE_MS", 10)) / 1000,
+)
+
 with app.app_context():
     db.create_all()
+    migrator.upgrade()
+    refresh_ip_index(force=True)
+    job_runner.resume(min_queued_age=0)
+
+migrator.start()
+job_runner.start()
+
+start_ip_index_refresher(IP_INDEX_REFRESH_SECONDS)
+
+if os.environ.get("ITEM_GROUP_COMMIT", "").lower() in ("1", "true", "yes"):
+    enable_item_group_commit(
+        max_batch=int(os.environ.get("ITEM_GROUP_COMMIT_MAX_BATCH", 64)),
+        max_wait=float(os.environ.get("ITEM_GROUP_COMMIT_MAX_WAIT_MS", 2)) / 1000,
+    )
+
+if os.environ.get("WRITE_COORDINATOR", "").lower() in ("1", "true", "yes"):
+    enable_write_coordinator(timeout=float(os.environ.get("WRITE_FORWARD_TIMEOUT", 60)))
 
 # -----------------------------------------------------------------------------
 # Run
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
-    print("Resolved DB path:", db_path)
+    print("Database:", database_url.render_as_string(hide_password=True))
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
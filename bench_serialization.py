@@ -0,0 +1,54 @@
+"""
+Per-request serialization cost of a store listing page: the flask_restx
+marshal path (marshal_list_with + Flask's JSON encoder) against the direct
+encoders used by the hot read endpoints.
+
+    python bench_serialization.py [stores] [items_per_store] [repeat]
+"""
+import json
+import sys
+import timeit
+
+from flask_restx import fields, marshal
+
+from fastjson import ENCODERS
+
+item_fields = {"name": fields.String, "ip": fields.String}
+store_fields = {
+    "name": fields.String,
+    "items": fields.List(fields.Nested(item_fields)),
+    "item_count": fields.Integer,
+}
+
+
+def page(stores, items_per_store):
+    return [
+        {
+            "name": f"Store{s}",
+            "items": [{"name": f"Item{i}", "ip": f"10.{s % 256}.{i // 256}.{i % 256}"}
+                      for i in range(items_per_store)],
+        }
+        for s in range(stores)
+    ]
+
+
+def main():
+    stores = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    items_per_store = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    data = page(stores, items_per_store)
+
+    runs = {"marshal + json": lambda: json.dumps(marshal(data, store_fields, skip_none=True)).encode()}
+    for name, dumps in ENCODERS.items():
+        runs[name] = lambda dumps=dumps: dumps(data)
+
+    print(f"{stores} stores x {items_per_store} items, best of 5 x {repeat}")
+    baseline = None
+    for name, fn in runs.items():
+        per_call = min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat
+        baseline = baseline or per_call
+        print(f"  {name:<16} {per_call * 1000:8.3f} ms/request  x{baseline / per_call:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
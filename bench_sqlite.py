@@ -0,0 +1,109 @@
+"""
+Mixed read/write load from several processes sharing one SQLite file, the
+way the replicas share instance/data.db, under each connection profile of
+sqliteprofile.py. Writes read before they write (like the API's write
+paths), which is where DEFERRED transactions fail with "database is locked".
+
+    python bench_sqlite.py [processes] [seconds] [write_ratio]
+"""
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from sqliteprofile import PROFILES, apply_pragmas
+
+SCHEMA = [
+    "CREATE TABLE store (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT NOT NULL, ip TEXT NOT NULL, "
+    "store_id INTEGER NOT NULL REFERENCES store(id))",
+    "CREATE INDEX ix_item_store_id ON item (store_id)",
+]
+STORES = 50
+
+
+def make_engine(path, profile):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        apply_pragmas(dbapi_connection, profile.pragmas)
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        write = conn.get_execution_options().get("write", False)
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if write and profile.immediate_writes else "BEGIN")
+
+    return engine
+
+
+def setup(path):
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO store (name) VALUES (?)", [(f"Store{n}",) for n in range(STORES)])
+    conn.commit()
+    conn.close()
+
+
+def worker(args):
+    path, profile_name, seconds, write_ratio, seed = args
+    engine = make_engine(path, PROFILES[profile_name])
+    rng = random.Random(seed)
+    reads = writes = locked = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        store_id = rng.randint(1, STORES)
+        try:
+            if rng.random() < write_ratio:
+                with engine.connect().execution_options(write=True) as conn, conn.begin():
+                    count = conn.execute(text("SELECT COUNT(*) FROM item WHERE store_id = :s"),
+                                         {"s": store_id}).scalar()
+                    conn.execute(text("INSERT INTO item (name, ip, store_id) VALUES (:n, :ip, :s)"),
+                                 {"n": f"Item{count}", "ip": f"10.0.{count // 256 % 256}.{count % 256}",
+                                  "s": store_id})
+                writes += 1
+            else:
+                with engine.connect() as conn, conn.begin():
+                    conn.execute(text("SELECT name, ip FROM item WHERE store_id = :s ORDER BY id LIMIT 100"),
+                                 {"s": store_id}).all()
+                reads += 1
+        except OperationalError as exc:
+            if "locked" not in str(exc):
+                raise
+            locked += 1
+    engine.dispose()
+    return reads, writes, locked
+
+
+def run(profile_name, processes, seconds, write_ratio):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup(path)
+        jobs = [(path, profile_name, seconds, write_ratio, n) for n in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(worker, jobs)
+    reads, writes, locked = (sum(column) for column in zip(*results))
+    return reads / seconds, writes / seconds, locked
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    write_ratio = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    print(f"{processes} processes x {seconds:g}s, {write_ratio:.0%} writes")
+    for name in PROFILES:
+        reads, writes, locked = run(name, processes, seconds, write_ratio)
+        print(f"  {name:<8} {reads:9.0f} reads/s {writes:8.0f} writes/s {locked:7d} 'database is locked'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of already-encoded responses.
+
+    Every entry carries a set of tags (e.g. "stores"); writes invalidate by
+    tag. A fill that started before an invalidation is dropped, so a reader
+    racing with a write cannot put the pre-write body back in the cache.
+
+    Lives in one process only; see SQLiteResponseCache / RedisResponseCache
+    for backends shared between replicas. All three take string keys and
+    (bytes, headers) values, so they can also hold lookup results.
+    """
+    backend = "memory"
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self):
+        """Token to pass to set(); taken before computing the value."""
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags, generation):
+        """Store `value` (bytes, headers) unless an invalidation happened since `generation`."""
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._remove(key)
+            self._entries[key] = (value, frozenset(tags), size)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, set()):
+                    if self._remove(key):
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        _, tags, size = entry
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        return True
+
+
+def _encode(value):
+    body, headers = value
+    return json.dumps(headers).encode() + b"\n" + body
+
+
+def _decode(raw):
+    headers, body = bytes(raw).split(b"\n", 1)
+    return body, [tuple(h) for h in json.loads(headers)]
+
+
+class SQLiteResponseCache:
+    """
+    Response cache kept in a SQLite file, shared by every process that opens
+    the same path (e.g. both replicas on the instance volume). Invalidation
+    deletes rows and bumps a generation counter stored in the file, so it is
+    seen by all replicas at once. Eviction is oldest-first so hits stay
+    read-only.
+    """
+    backend = "sqlite"
+
+    def __init__(self, path, max_entries=256, max_bytes=32 * 1024 * 1024, timeout=5):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO cache_meta (id, generation) VALUES (1, 0);
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cache_entries_created ON cache_entries (created);
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, key)
+            );
+            CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key);
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back if the body raises."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def generation(self):
+        return self._conn().execute("SELECT generation FROM cache_meta").fetchone()[0]
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _decode(row[0])
+
+    def set(self, key, value, tags, generation):
+        raw = _encode(value)
+        if len(raw) > self.max_bytes:
+            return
+        with self._write() as conn:
+            if conn.execute("SELECT generation FROM cache_meta").fetchone()[0] != generation:
+                return
+            conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, created) VALUES (?, ?, ?, ?)",
+                (key, raw, len(raw), time.time()),
+            )
+            conn.executemany("INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                             [(tag, key) for tag in tags])
+            self._evict(conn)
+
+    def _evict(self, conn):
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY created"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+        conn.executemany("DELETE FROM cache_tags WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def invalidate(self, *tags):
+        with self._write() as conn:
+            conn.execute("UPDATE cache_meta SET generation = generation + 1")
+            marks = ",".join("?" * len(tags))
+            keys = conn.execute(
+                f"SELECT DISTINCT key FROM cache_tags WHERE tag IN ({marks})", tags
+            ).fetchall() if tags else []
+            conn.executemany("DELETE FROM cache_entries WHERE key = ?", keys)
+            conn.executemany("DELETE FROM cache_tags WHERE key = ?", keys)
+        self.invalidations += len(keys)
+
+    def clear(self):
+        with self._write() as conn:
+            conn.execute("UPDATE cache_meta SET generation = generation + 1")
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("DELETE FROM cache_tags")
+
+    def stats(self):
+        entries, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        return {
+            "backend": self.backend,
+            "entries": entries,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class RedisError(Exception):
+    pass
+
+
+# What a shared backend raises when it is unreachable, locked or broken.
+BACKEND_ERRORS = (OSError, RedisError, sqlite3.Error)
+
+
+class RedisConnection:
+    """
+    Minimal RESP2 client: enough for the cache, no third-party dependency.
+    Works against Redis or any server speaking the same protocol.
+    """
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=5):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rb")
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    @classmethod
+    def from_url(cls, url, timeout=5):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password, timeout)
+
+    def execute(self, *args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._sock.sendall(b"".join(out))
+        return self._read()
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise RedisError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read() for _ in range(length)]
+        raise RedisError(f"unexpected reply: {line!r}")
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class RedisResponseCache:
+    """
+    Response cache on a Redis-protocol server shared by all replicas.
+
+    Entries expire after `ttl` seconds; overall memory is bounded by the
+    server's maxmemory policy. Fills WATCH the generation key, so a fill
+    that overlaps an invalidation from any replica is aborted by EXEC.
+    """
+    backend = "redis"
+
+    def __init__(self, url, max_bytes=32 * 1024 * 1024, ttl=300, prefix="core-api:cache:"):
+        self.url = url
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = RedisConnection.from_url(self.url)
+        return conn
+
+    def _execute(self, *args):
+        try:
+            return self._conn().execute(*args)
+        except (OSError, RedisError):
+            # Drop a broken connection so the next call reconnects.
+            conn = getattr(self._local, "conn", None)
+            self._local.conn = None
+            if conn is not None:
+                conn.close()
+            raise
+
+    def generation(self):
+        return int(self._execute("GET", self.prefix + "generation") or 0)
+
+    def get(self, key):
+        raw = self._execute("GET", self.prefix + "entry:" + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _decode(raw)
+
+    def set(self, key, value, tags, generation):
+        raw = _encode(value)
+        if len(raw) > self.max_bytes:
+            return
+        gen_key = self.prefix + "generation"
+        entry_key = self.prefix + "entry:" + key
+        self._execute("WATCH", gen_key)
+        if int(self._execute("GET", gen_key) or 0) != generation:
+            self._execute("UNWATCH")
+            return
+        self._execute("MULTI")
+        self._execute("SET", entry_key, raw, "EX", self.ttl)
+        for tag in tags:
+            self._execute("SADD", self.prefix + "tag:" + tag, entry_key)
+            self._execute("EXPIRE", self.prefix + "tag:" + tag, self.ttl)
+        self._execute("EXEC")
+
+    def invalidate(self, *tags):
+        self._execute("INCR", self.prefix + "generation")
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            keys = self._execute("SMEMBERS", tag_key) or []
+            if keys:
+                self.invalidations += self._execute("DEL", *keys)
+            self._execute("DEL", tag_key)
+
+    def clear(self):
+        self._execute("INCR", self.prefix + "generation")
+        for pattern in ("entry:*", "tag:*"):
+            cursor = b"0"
+            while True:
+                cursor, keys = self._execute("SCAN", cursor, "MATCH", self.prefix + pattern, "COUNT", 500)
+                if keys:
+                    self._execute("DEL", *keys)
+                if cursor == b"0":
+                    break
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+def create_response_cache(backend="memory", url=None, max_entries=256, max_bytes=32 * 1024 * 1024, ttl=300):
+    """Build the configured cache backend ("memory", "sqlite" or "redis")."""
+    if backend == "memory":
+        return ResponseCache(max_entries=max_entries, max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SQLiteResponseCache(url, max_entries=max_entries, max_bytes=max_bytes)
+    if backend == "redis":
+        return RedisResponseCache(url or "redis://localhost:6379/0", max_bytes=max_bytes, ttl=ttl)
+    raise ValueError(f"unknown cache backend: {backend}")
@@ -0,0 +1,17 @@
+import os
+import shutil
+import tempfile
+
+# app.py reads its configuration at import time, so point it at a scratch
+# database and jobs directory before test modules import it. Set
+# TEST_DATABASE_URI to run the suite against another database, e.g.
+#   TEST_DATABASE_URI=postgresql+psycopg2://localhost/core_test python -m pytest -q test_app.py
+_scratch = tempfile.mkdtemp(prefix="core-test-")
+os.environ["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "TEST_DATABASE_URI", "sqlite:///" + os.path.join(_scratch, "data.db"))
+os.environ.pop("SQLALCHEMY_READ_DATABASE_URI", None)
+os.environ["JOB_DIR"] = os.path.join(_scratch, "jobs")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_scratch, ignore_errors=True)
@@ -0,0 +1,32 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speed-up, the stdlib encoder is always there
+    orjson = None
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+ENCODERS = {"stdlib": _stdlib_dumps}
+if orjson is not None:
+    ENCODERS["orjson"] = orjson.dumps
+
+
+def register_encoder(name, dumps):
+    """Add an encoder: a callable taking plain dicts/lists and returning bytes."""
+    ENCODERS[name] = dumps
+
+
+def get_encoder(name="auto"):
+    """
+    Return (name, dumps) for `name`; "auto" picks orjson when installed and
+    falls back to the stdlib encoder.
+    """
+    if name == "auto":
+        name = "orjson" if "orjson" in ENCODERS else "stdlib"
+    if name not in ENCODERS:
+        raise ValueError(f"unknown JSON encoder: {name} (available: {', '.join(ENCODERS)})")
+    return name, ENCODERS[name]
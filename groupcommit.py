@@ -0,0 +1,83 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitter:
+    """
+    Funnel concurrent writes through one writer thread that applies them in
+    batches: the first queued write opens a window of `max_wait` seconds (or
+    until `max_batch` writes are queued), then `apply_batch` runs once for
+    the whole window, so one commit/fsync is shared by every write in it.
+
+    `apply_batch(payloads)` must return one result per payload, in order;
+    each submitter's future resolves only after that call returns, i.e.
+    after the batch is durable. If it raises, every write in the batch
+    fails with the same exception.
+    """
+    def __init__(self, apply_batch, max_batch=64, max_wait=0.002, name="group-commit"):
+        self.apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._closed = False
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, payload):
+        if self._closed:
+            raise RuntimeError("group committer is closed")
+        future = Future()
+        self._queue.put((payload, future))
+        return future
+
+    def close(self):
+        """Stop accepting writes; queued ones are still applied."""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "writes": self.writes,
+            "avg_batch": self.writes / self.batches if self.batches else 0,
+            "queued": self._queue.qsize(),
+        }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                results = self.apply_batch([payload for payload, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            self.batches += 1
+            self.writes += len(batch)
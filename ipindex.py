@@ -0,0 +1,132 @@
+import ipaddress
+import threading
+
+from iputils import to_mapped_int, to_mapped_network
+
+_MASKS = [((1 << 128) - 1) ^ ((1 << (128 - n)) - 1) for n in range(129)]
+
+
+class IPOwnershipIndex:
+    """
+    In-memory longest-prefix-match index from IP addresses to the items
+    (and stores) that own them. Item IPs may be plain addresses (/32, /128)
+    or prefixes; IPv4 lives in the IPv4-mapped IPv6 space.
+
+    One hash table per prefix length, probed from the longest length down,
+    so a lookup costs at most one dict probe per distinct length in use.
+
+    `version` is the catalog version the contents reflect. Writes commit
+    their versions in one order and may call apply() in another, so a change
+    that arrives ahead of its turn is held back until the versions before it
+    have been applied. A gap that is never filled locally (a write made by
+    another replica) is closed by the next build(); past `max_pending`
+    held-back changes the index is marked stale instead.
+    """
+    def __init__(self, max_pending=1024):
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._lengths = []
+        self._by_store = {}
+        self._pending = {}
+        self.max_pending = max_pending
+        self.version = None
+        self.stale = True
+
+    def build(self, rows, version):
+        """Replace the contents with `rows` of (store, item, ip)."""
+        tables, by_store = {}, {}
+        for store, item, ip in rows:
+            self._insert(tables, by_store, store, item, ip)
+        with self._lock:
+            self._tables, self._by_store = tables, by_store
+            self._lengths = sorted(tables, reverse=True)
+            self.version = version
+            self.stale = False
+            self._pending = {v: c for v, c in self._pending.items() if v > version}
+            self._apply_pending()
+
+    def apply(self, version, change=None, *args):
+        """Record that the catalog reached `version` through change(*args)."""
+        with self._lock:
+            if self.stale or self.version is None or version <= self.version:
+                # A rebuild is due anyway, or the build already saw this write.
+                return
+            self._pending[version] = (change, args)
+            self._apply_pending()
+            if len(self._pending) > self.max_pending:
+                self._pending.clear()
+                self.stale = True
+
+    def _apply_pending(self):
+        while self.version + 1 in self._pending:
+            change, args = self._pending.pop(self.version + 1)
+            if change is not None:
+                change(*args)
+            self.version += 1
+
+    @staticmethod
+    def _insert(tables, by_store, store, item, ip):
+        key = to_mapped_network(ip)
+        if key is None:
+            return
+        network, prefixlen = key
+        owner = {"store": store, "item": item, "ip": ip}
+        tables.setdefault(prefixlen, {}).setdefault(network, []).append(owner)
+        by_store.setdefault(store, []).append((prefixlen, network, owner))
+
+    # The three mutators below are meant to be passed to apply().
+    def add(self, store, item, ip):
+        self._insert(self._tables, self._by_store, store, item, ip)
+        self._lengths = sorted(self._tables, reverse=True)
+
+    def add_many(self, rows):
+        for store, item, ip in rows:
+            self._insert(self._tables, self._by_store, store, item, ip)
+        self._lengths = sorted(self._tables, reverse=True)
+
+    def rename_store(self, old, new):
+        entries = self._by_store.pop(old, [])
+        for _, _, owner in entries:
+            owner["store"] = new
+        if entries:
+            self._by_store.setdefault(new, []).extend(entries)
+
+    def remove_store(self, store):
+        for prefixlen, network, owner in self._by_store.pop(store, []):
+            owners = self._tables[prefixlen][network]
+            owners.remove(owner)
+            if not owners:
+                del self._tables[prefixlen][network]
+                if not self._tables[prefixlen]:
+                    del self._tables[prefixlen]
+        self._lengths = sorted(self._tables, reverse=True)
+
+    def lookup(self, address):
+        """
+        Most specific match for `address` as {"prefix", "owners"}, or None.
+        Raises ValueError if `address` is not an IP address.
+        """
+        value = to_mapped_int(address)
+        if value is None:
+            raise ValueError(f"not an IP address: {address}")
+        tables, lengths = self._tables, self._lengths
+        for prefixlen in lengths:
+            owners = tables.get(prefixlen, {}).get(value & _MASKS[prefixlen])
+            if owners:
+                addr = ipaddress.IPv6Address(value)
+                if addr.ipv4_mapped is not None and prefixlen >= 96:
+                    prefix = ipaddress.ip_network((addr.ipv4_mapped, prefixlen - 96), strict=False)
+                else:
+                    prefix = ipaddress.ip_network((addr, prefixlen), strict=False)
+                return {"prefix": str(prefix), "owners": [dict(o) for o in owners]}
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "stale": self.stale,
+                "pending": len(self._pending),
+                "prefixes": sum(len(t) for t in self._tables.values()),
+                "prefix_lengths": len(self._lengths),
+            }
@@ -0,0 +1,73 @@
+import ipaddress
+
+
+def ip_to_bin(value):
+    """
+    Encode an IPv4/IPv6 address as 16 big-endian bytes (IPv4 as ::ffff:a.b.c.d),
+    so byte order equals numeric order and both families share one index.
+    Returns None for values that are not IP addresses.
+    """
+    try:
+        addr = ipaddress.ip_address(value.strip())
+    except (AttributeError, ValueError):
+        return None
+    if addr.version == 4:
+        addr = ipaddress.IPv6Address(b"\0" * 10 + b"\xff\xff" + addr.packed)
+    return addr.packed
+
+
+def parse_cidr(value):
+    """Parse a prefix such as 10.20.0.0/16; host bits are ignored."""
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+
+def cidr_range(network):
+    """First and last encoded address of a network, for a BETWEEN scan."""
+    return ip_to_bin(str(network.network_address)), ip_to_bin(str(network.broadcast_address))
+
+
+def ip_range_to_bin(value):
+    """
+    First and last encoded address of an address or of a prefix such as
+    10.1.0.0/16 (host bits ignored); an address is a range of one. Returns
+    (None, None) for anything else.
+    """
+    try:
+        network = ipaddress.ip_network(value.strip(), strict=False)
+    except (AttributeError, ValueError):
+        return None, None
+    return cidr_range(network)
+
+
+def supernet_starts(network):
+    """
+    Encoded first address of every prefix that strictly contains `network`
+    and starts before it: where a prefix covering all of `network` can start.
+    """
+    start, prefixlen = to_mapped_network(str(network))
+    starts = set()
+    for length in range(prefixlen):
+        host_bits = 128 - length
+        supernet = start >> host_bits << host_bits
+        if supernet < start:
+            starts.add(supernet.to_bytes(16, "big"))
+    return sorted(starts)
+
+
+def to_mapped_int(value):
+    """An address as a 128-bit integer in the same IPv4-mapped space as ip_to_bin."""
+    packed = ip_to_bin(value)
+    return None if packed is None else int.from_bytes(packed, "big")
+
+
+def to_mapped_network(value):
+    """
+    An address or prefix (e.g. 10.0.0.0/24) as (network int, prefix length)
+    in the IPv4-mapped space; None if `value` is neither.
+    """
+    try:
+        network = ipaddress.ip_network(value.strip(), strict=False)
+    except (AttributeError, ValueError):
+        return None
+    prefixlen = network.prefixlen + (96 if network.version == 4 else 0)
+    return to_mapped_int(str(network.network_address)), prefixlen
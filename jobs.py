@@ -0,0 +1,227 @@
+import datetime
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select, update
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class JobContext:
+    """
+    What a job handler gets: its id and params, plus progress reporting.
+    progress() commits the handler's session, so call it between the
+    handler's own transactions, not in the middle of one; or pass
+    commit=False to record it in the current transaction. A job picked up
+    again after its worker died starts with `resume_from` set to the last
+    progress it recorded.
+    """
+    def __init__(self, runner, job_id, params, resume_from=0):
+        self.runner = runner
+        self.job_id = job_id
+        self.params = params
+        self.resume_from = resume_from
+        self.result_location = None
+
+    def progress(self, done, total=None, commit=True):
+        values = {"progress_done": done, "lease_until": time.time() + self.runner.lease_seconds}
+        if total is not None:
+            values["progress_total"] = total
+        Job = self.runner.job_model
+        session = self.runner.db.session
+        if commit:
+            # End the handler's read transaction first: on SQLite a transaction
+            # that has read cannot wait for the write lock, it fails at once.
+            session.commit()
+        session.execute(update(Job).where(Job.id == self.job_id).values(**values))
+        if commit:
+            session.commit()
+
+
+class JobRunner:
+    """
+    Runs registered job kinds on a thread pool. Jobs are rows in the job
+    table, so status and progress survive restarts and are visible from
+    every replica.
+
+    A worker claims a job with a conditional UPDATE and holds it under a
+    lease that a heartbeat thread renews while it runs. Every replica
+    periodically re-queues running jobs whose lease has expired (their
+    worker died) and queued jobs nobody has picked up; the claim makes sure
+    each runs once. A job claimed `max_attempts` times without finishing
+    is marked failed and its kind's cleanup runs.
+    """
+    def __init__(self, app, db, job_model, workers=2, lease_seconds=60, max_attempts=3):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self.cleanups = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._futures = {}
+        self._running = set()
+        self._thread = None
+
+    def register(self, kind, handler, cleanup=None):
+        """
+        `handler(ctx)` does the work and returns a JSON-able result.
+        `cleanup(job_id)` removes what a job that was given up on left behind.
+        """
+        self.handlers[kind] = handler
+        if cleanup is not None:
+            self.cleanups[kind] = cleanup
+
+    def submit(self, kind, params, user=None, job_id=None):
+        """Persist a queued job and hand it to the pool. Returns the job row."""
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job kind: {kind}")
+        job = self.job_model(
+            id=job_id or new_job_id(),
+            kind=kind,
+            status="queued",
+            params=params,
+            created_by=user,
+            created_at=utcnow(),
+        )
+        self.db.session.add(job)
+        self.db.session.commit()
+        self._enqueue(job.id)
+        return job
+
+    def resume(self, min_queued_age=None):
+        """
+        Queue jobs whose worker died (lease expired) and jobs queued for
+        longer than `min_queued_age` seconds (default: one lease), then
+        give up on those out of attempts.
+        """
+        Job = self.job_model
+        session = self.db.session
+        now = time.time()
+        if min_queued_age is None:
+            min_queued_age = self.lease_seconds
+        orphaned = (Job.status == "running") & (Job.lease_until < now)
+        waiting = (Job.status == "queued") & (
+            Job.created_at <= utcnow() - datetime.timedelta(seconds=min_queued_age))
+        rows = session.execute(select(Job.id, Job.kind, Job.attempts).where(orphaned | waiting)).all()
+        session.commit()
+        for job_id, kind, attempts in rows:
+            if job_id in self._futures:
+                continue
+            if (attempts or 0) >= self.max_attempts:
+                self._abandon(job_id, kind)
+            else:
+                self._enqueue(job_id)
+
+    def start(self, interval=None):
+        """Renew the leases of running jobs and call resume() periodically."""
+        interval = interval or self.lease_seconds / 3
+
+        def run():
+            while True:
+                time.sleep(interval)
+                with self.app.app_context():
+                    try:
+                        self._renew_leases()
+                        self.resume()
+                    except Exception:
+                        self.app.logger.exception("job heartbeat failed")
+                    finally:
+                        self.db.session.remove()
+
+        self._thread = threading.Thread(target=run, name="job-heartbeat", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wait(self, job_id, timeout=None):
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+
+    def _enqueue(self, job_id):
+        future = self._executor.submit(self._run, job_id)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+
+    def _renew_leases(self):
+        running = list(self._running)
+        if not running:
+            return
+        Job = self.job_model
+        self.db.session.execute(
+            update(Job)
+            .where(Job.id.in_(running), Job.status == "running")
+            .values(lease_until=time.time() + self.lease_seconds)
+        )
+        self.db.session.commit()
+
+    def _claim(self, job_id):
+        Job = self.job_model
+        now = time.time()
+        claimed = self.db.session.execute(
+            update(Job)
+            .where(
+                Job.id == job_id,
+                (Job.status == "queued") | ((Job.status == "running") & (Job.lease_until < now)),
+                func.coalesce(Job.attempts, 0) < self.max_attempts,
+            )
+            .values(status="running", started_at=utcnow(), lease_until=now + self.lease_seconds,
+                    attempts=func.coalesce(Job.attempts, 0) + 1)
+        ).rowcount
+        self.db.session.commit()
+        return bool(claimed)
+
+    def _run(self, job_id):
+        Job = self.job_model
+        with self.app.app_context():
+            session = self.db.session
+            if not self._claim(job_id):
+                return
+            self._running.add(job_id)
+            try:
+                kind, params, done = session.execute(
+                    select(Job.kind, Job.params, Job.progress_done).where(Job.id == job_id)
+                ).one()
+                session.commit()
+                ctx = JobContext(self, job_id, dict(params or {}), resume_from=done or 0)
+                try:
+                    result = self.handlers[kind](ctx)
+                except Exception as exc:
+                    session.rollback()
+                    self.app.logger.exception("job %s (%s) failed", job_id, kind)
+                    self._finish(job_id, status="failed", error=str(exc) or exc.__class__.__name__)
+                else:
+                    self._finish(job_id, status="succeeded", result=result,
+                                 result_location=ctx.result_location)
+            finally:
+                self._running.discard(job_id)
+
+    def _abandon(self, job_id, kind):
+        Job = self.job_model
+        now = time.time()
+        abandoned = self.db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status.in_(("queued", "running")),
+                   (Job.status == "queued") | (Job.lease_until < now))
+            .values(status="failed", finished_at=utcnow(), lease_until=None,
+                    error=f"abandoned after {self.max_attempts} attempts")
+        ).rowcount
+        self.db.session.commit()
+        if abandoned and kind in self.cleanups:
+            self.cleanups[kind](job_id)
+
+    def _finish(self, job_id, **values):
+        Job = self.job_model
+        self.db.session.execute(
+            update(Job).where(Job.id == job_id).values(finished_at=utcnow(), lease_until=None, **values)
+        )
+        self.db.session.commit()
@@ -0,0 +1,316 @@
+import datetime
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from sqlalchemy import bindparam, insert, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+# `apply(ctx)` calls MigrationContext steps. Offline migrations run before the
+# app serves (the code depends on them); online ones run afterwards on a
+# background thread while both replicas keep serving.
+Migration = namedtuple("Migration", "version name apply online")
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class MigrationContext:
+    """
+    Steps of one migration. Every call is a numbered step whose completion is
+    recorded, so a resumed migration skips finished steps and a backfill
+    restarts after its last committed batch. Steps must be idempotent.
+    """
+    def __init__(self, migrator, record):
+        self.migrator = migrator
+        self.db = migrator.db
+        self.version = record.version
+        self._done = record.step
+        self._cursor = record.cursor
+        self._step = 0
+
+    def _should_run(self):
+        self._step += 1
+        return self._step > self._done
+
+    def _finish_step(self):
+        self.migrator._record(self.version, step=self._step, cursor=None)
+
+    @contextmanager
+    def _ddl_connection(self):
+        """
+        A connection for DDL. On PostgreSQL it is a separate AUTOCOMMIT
+        connection without the app's statement_timeout, which would cancel
+        a long index build and leave an invalid index behind.
+        """
+        engine = self.db.engine
+        if engine.dialect.name != "postgresql":
+            with engine.begin() as conn:
+                yield conn
+            return
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SET statement_timeout = 0"))
+            try:
+                yield conn
+            finally:
+                # Back to the connect-time setting before it returns to the pool.
+                conn.execute(text("RESET statement_timeout"))
+
+    def add_column(self, column):
+        """ALTER TABLE ... ADD COLUMN for a nullable column unless it exists (no rewrite)."""
+        if not self._should_run():
+            return
+        table = column.table
+        engine = self.db.engine
+        if column.name not in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+            with self._ddl_connection() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                ))
+        self._finish_step()
+
+    def create_index(self, index):
+        """
+        Build an index unless it exists. PostgreSQL builds it CONCURRENTLY, so
+        reads and writes carry on; SQLite (in WAL mode) keeps serving reads
+        while the build holds the write lock.
+        """
+        if not self._should_run():
+            return
+        engine = self.db.engine
+        ddl = str(CreateIndex(index, if_not_exists=True).compile(engine))
+        with self._ddl_connection() as conn:
+            if engine.dialect.name == "postgresql":
+                # An interrupted concurrent build leaves an invalid index behind.
+                invalid = conn.execute(text(
+                    "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ), {"name": index.name}).first()
+                if invalid:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY {index.name}"))
+                ddl = ddl.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+            conn.execute(text(ddl))
+        self._finish_step()
+
+    def backfill(self, column, compute, source, batch_size=None):
+        """
+        Fill the NULLs of `column` with compute(row), `row` holding the
+        `source` columns, in primary-key order, one committed batch at a time.
+        Rows written meanwhile keep whatever value the app gave them.
+        """
+        if not self._should_run():
+            return
+        session = self.db.session
+        table = column.table
+        (key,) = table.primary_key.columns
+        batch_size = batch_size or self.migrator.batch_size
+        stmt = (
+            update(table)
+            .where(key == bindparam("_key"), column.is_(None))
+            .values({column.name: bindparam("_value")})
+        )
+        cursor = self._cursor or 0
+        while True:
+            rows = session.execute(
+                select(key, *source).where(key > cursor, column.is_(None)).order_by(key).limit(batch_size)
+            ).all()
+            # Read and write in separate transactions: on SQLite a transaction
+            # that has read cannot wait for the write lock.
+            session.commit()
+            if not rows:
+                break
+            session.execute(stmt, [{"_key": row[0], "_value": compute(row)} for row in rows])
+            cursor = rows[-1][0]
+            self.migrator._record(self.version, cursor=cursor, commit=False)
+            session.commit()
+            # Let the app's writers in between batches.
+            time.sleep(self.migrator.batch_pause)
+        self._finish_step()
+
+    def run(self, fn, *args):
+        """Any other idempotent step."""
+        if not self._should_run():
+            return
+        fn(*args)
+        self._finish_step()
+
+
+class Migrator:
+    """
+    Applies versioned migrations in order, recording their status and step
+    progress in the schema_migration table. A migration is run under a lease,
+    renewed by a heartbeat thread while it runs, so that only one replica
+    applies it; the others wait for it to finish. A migration interrupted
+    by a crash resumes once its lease has expired.
+    """
+    LEASE_SECONDS = 60
+    POLL_SECONDS = 1
+
+    def __init__(self, app, db, record_model, migrations, batch_size=1000, batch_pause=0.01):
+        self.app = app
+        self.db = db
+        self.record_model = record_model
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._thread = None
+
+    def upgrade(self):
+        """
+        Apply the pending offline migrations, which the code depends on, even
+        those numbered after an online migration still running in the
+        background; offline migrations must therefore not depend on online ones.
+        """
+        for migration in self._pending():
+            if not migration.online:
+                self.apply(migration)
+
+    def start(self):
+        """Apply the remaining migrations on a background thread."""
+        if not self._pending():
+            return None
+        self._thread = threading.Thread(target=self._run_all, name="schema-migrations", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wait(self, timeout=None):
+        """Block until the background migrations (if any) have finished."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self):
+        Record = self.record_model
+        records = {r.version: r for r in self.db.session.execute(select(Record)).scalars()}
+        result = []
+        for migration in self.migrations:
+            record = records.get(migration.version)
+            result.append({
+                "version": migration.version,
+                "name": migration.name,
+                "online": migration.online,
+                "status": record.status if record else "pending",
+                "step": record.step if record else 0,
+                "cursor": record.cursor if record else None,
+                "error": record.error if record else None,
+            })
+        return result
+
+    def apply(self, migration):
+        """Run one migration, or wait for the replica running it. Raises if it fails."""
+        while not self._claim(migration):
+            record = self.db.session.get(self.record_model, migration.version)
+            status = record.status
+            self.db.session.commit()
+            if status == "done":
+                return
+            time.sleep(self.POLL_SECONDS)
+
+        record = self.db.session.get(self.record_model, migration.version)
+        done = record.status == "done"
+        ctx = MigrationContext(self, record)
+        self.db.session.commit()
+        if done:
+            self._release(migration.version)
+            return
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(migration.version, stop),
+                                     name="schema-migration-lease", daemon=True)
+        heartbeat.start()
+        try:
+            try:
+                migration.apply(ctx)
+            finally:
+                # Stopped before the outcome is recorded, so it cannot renew
+                # the lease of a finished migration.
+                stop.set()
+                heartbeat.join()
+        except Exception as exc:
+            self.db.session.rollback()
+            self._record(migration.version, status="failed", error=str(exc) or exc.__class__.__name__,
+                         lease_until=0)
+            raise
+        self._record(migration.version, status="done", finished_at=utcnow(), error=None, lease_until=0)
+
+    def _pending(self):
+        Record = self.record_model
+        with self.app.app_context():
+            done = set(self.db.session.execute(
+                select(Record.version).where(Record.status == "done")
+            ).scalars())
+        return [m for m in self.migrations if m.version not in done]
+
+    def _run_all(self):
+        with self.app.app_context():
+            for migration in self._pending():
+                try:
+                    self.apply(migration)
+                except Exception:
+                    self.app.logger.exception("migration %s (%s) failed", migration.version, migration.name)
+                    return
+
+    def _claim(self, migration):
+        Record = self.record_model
+        session = self.db.session
+        missing = session.get(Record, migration.version) is None
+        # End the read transaction: on SQLite it could not take the write lock.
+        session.commit()
+        if missing:
+            try:
+                session.execute(insert(Record).values(
+                    version=migration.version, name=migration.name, status="pending", step=0
+                ))
+                session.commit()
+            except IntegrityError:  # another replica inserted it first
+                session.rollback()
+        now = time.time()
+        claimed = session.execute(
+            update(Record)
+            .where(
+                Record.version == migration.version,
+                (Record.owner == self.owner) | Record.lease_until.is_(None) | (Record.lease_until < now),
+            )
+            .values(owner=self.owner, lease_until=now + self.LEASE_SECONDS)
+        ).rowcount
+        session.commit()
+        if claimed:
+            session.execute(
+                update(Record)
+                .where(Record.version == migration.version, Record.status != "done")
+                .values(status="running", started_at=utcnow())
+            )
+            session.commit()
+        return bool(claimed)
+
+    def _heartbeat(self, version, stop):
+        """Renew the lease while a step runs (a single index build can outlast it)."""
+        Record = self.record_model
+        with self.app.app_context():
+            while not stop.wait(self.LEASE_SECONDS / 3):
+                try:
+                    self.db.session.execute(
+                        update(Record)
+                        .where(Record.version == version, Record.owner == self.owner)
+                        .values(lease_until=time.time() + self.LEASE_SECONDS)
+                    )
+                    self.db.session.commit()
+                except Exception:
+                    self.db.session.rollback()
+                    self.app.logger.exception("renewing the lease of migration %s failed", version)
+            self.db.session.remove()
+
+    def _release(self, version):
+        self._record(version, lease_until=0)
+
+    def _record(self, version, commit=True, **values):
+        """Update the migration's row and renew its lease."""
+        Record = self.record_model
+        values.setdefault("lease_until", time.time() + self.LEASE_SECONDS)
+        self.db.session.execute(update(Record).where(Record.version == version).values(**values))
+        if commit:
+            self.db.session.commit()
@@ -1,5 +1,6 @@
 from .client import CoreAPIClient
 from .auth import AuthAPI
 from .store import StoreAPI
+from .jobs import JobsAPI
 
-__all__ = ["CoreAPIClient", "AuthAPI", "StoreAPI"]
\ No newline at end of file
+__all__ = ["CoreAPIClient", "AuthAPI", "StoreAPI", "JobsAPI"]
\ No newline at end of file
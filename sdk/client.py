@@ -5,27 +5,46 @@ class CoreAPIClient:
     """
     Core client for the Store API.
     Handles base URL, JWT token, headers and HTTP requests.
+    Remembers the catalog version of its last write (X-Catalog-Version) and
+    sends it with reads, so they see that write even when served by a
+    lagging read replica.
     """
     def __init__(self, base_url, token=None, timeout=10):
         self.base_url = base_url.rstrip("/")
         self.token = token
         self.timeout = timeout
+        self.catalog_version = None
 
     def _headers(self):
         headers = {"Content-Type": "application/json"}
         if self.token:
             headers["Authorization"] = f"Bearer {self.token}"
+        if self.catalog_version is not None:
+            headers["X-Min-Catalog-Version"] = str(self.catalog_version)
         return headers
 
-    def _request(self, method, path, **kwargs):
+    def _track_version(self, resp):
+        version = resp.headers.get("X-Catalog-Version")
+        if version is not None and int(version) > (self.catalog_version or 0):
+            self.catalog_version = int(version)
+
+    def _request(self, method, path, idempotency_key=None, **kwargs):
+        # Assume JSON API
+        return self._send(method, path, idempotency_key=idempotency_key, **kwargs).json()
+
+    def _send(self, method, path, idempotency_key=None, **kwargs):
         url = self.base_url + path
+        headers = {**self._headers(), **kwargs.pop("headers", {})}
+        if idempotency_key is not None:
+            headers["Idempotency-Key"] = idempotency_key
         resp = requests.request(
             method,
             url,
-            headers=self._headers(),
+            headers=headers,
             timeout=self.timeout,
             **kwargs
         )
+        self._track_version(resp)
 
         # Basic error handling
         if resp.status_code >= 400:
@@ -36,8 +55,42 @@ class CoreAPIClient:
 
             raise Exception(f"API Error {resp.status_code}: {data}")
 
-        # Assume JSON API
-        return resp.json()
+        return resp
+
+    def get_page(self, path, params=None):
+        """
+        GET one page of a paginated endpoint. Returns (body, cursor), cursor
+        being the X-Next-Cursor header (None on the last page).
+        """
+        resp = self._send("GET", path, params=params)
+        return resp.json(), resp.headers.get("X-Next-Cursor")
+
+    def iter_pages(self, path, params=None, key=None):
+        """
+        Yield the entries of every page (body[key] if key is given),
+        following X-Next-Cursor.
+        """
+        params = dict(params or {})
+        while True:
+            body, cursor = self.get_page(path, params=params)
+            yield from body[key] if key else body
+            if cursor is None:
+                return
+            params["after"] = cursor
+
+    def stream_lines(self, path, **kwargs):
+        """
+        GET a line-delimited response and yield it one line at a time.
+        """
+        url = self.base_url + path
+        with requests.get(url, headers=self._headers(), timeout=self.timeout,
+                          stream=True, **kwargs) as resp:
+            self._track_version(resp)
+            if resp.status_code >= 400:
+                raise Exception(f"API Error {resp.status_code}: {resp.text}")
+            for line in resp.iter_lines(decode_unicode=True):
+                if line:
+                    yield line
 
     def get(self, path, **kwargs):
         return self._request("GET", path, **kwargs)
@@ -0,0 +1,50 @@
+import time
+
+
+class JobsAPI:
+    """
+    Background jobs of the Store API.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def start_export(self):
+        """
+        POST /jobs
+        Starts an export of every store with its items. Returns the job.
+        """
+        return self.client.post("/jobs", json={"kind": "export"})
+
+    def start_store_delete(self, name):
+        """
+        POST /jobs
+        Starts deleting a store in batches (admin only). Returns the job.
+        """
+        return self.client.post("/jobs", json={"kind": "delete_store", "params": {"store": name}})
+
+    def get_job(self, job_id):
+        """
+        GET /jobs/<job_id>
+        Returns the status, progress and result of a job.
+        """
+        return self.client.get(f"/jobs/{job_id}")
+
+    def wait(self, job_id, interval=1.0, timeout=None):
+        """
+        Polls a job until it has succeeded or failed and returns it.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"job {job_id} still {job['status']}")
+            time.sleep(interval)
+
+    def export_lines(self, job_id):
+        """
+        GET /jobs/<job_id>/result
+        Yields the lines of a finished export job's NDJSON file.
+        """
+        yield from self.client.stream_lines(f"/jobs/{job_id}/result")
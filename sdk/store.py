@@ -1,3 +1,6 @@
+import json
+
+
 class StoreAPI:
     """
     Store and Item operations for the Store API.
@@ -5,12 +8,104 @@ class StoreAPI:
     def __init__(self, client):
         self.client = client
 
-    def list_stores(self):
+    def list_stores(self, limit=None, after=None, fields=None, embed=None):
+        """
+        GET /store/
+        Returns every store, following the pages. With `limit` or `after`
+        returns that one page only; list_stores_page() also gives the
+        cursor of the next one. `fields` (e.g. "name") and `embed`
+        ("items", "count" or "none") trim what is returned.
+        """
+        if limit is None and after is None:
+            return list(self.iter_stores(fields=fields, embed=embed))
+        return self.list_stores_page(limit, after, fields, embed)[0]
+
+    def list_stores_page(self, limit=None, after=None, fields=None, embed=None):
         """
         GET /store/
-        Returns a list of stores.
+        Returns (stores, cursor) for one page; pass cursor as `after` to
+        get the next page. It is None on the last page.
         """
-        return self.client.get("/store/")
+        params = {"limit": limit, "after": after, "fields": fields, "embed": embed}
+        return self.client.get_page("/store/", params={k: v for k, v in params.items() if v is not None})
+
+    def iter_stores(self, fields=None, embed=None, page_size=None):
+        """
+        GET /store/
+        Yields every store, one page at a time.
+        """
+        params = {"limit": page_size, "fields": fields, "embed": embed}
+        return self.client.iter_pages("/store/", params={k: v for k, v in params.items() if v is not None})
+
+    def export_stores(self):
+        """
+        GET /store/export.ndjson
+        Yields every store (with its items) as it is streamed by the server.
+        """
+        for line in self.client.stream_lines("/store/export.ndjson"):
+            yield json.loads(line)
+
+    def store_stats(self):
+        """
+        GET /store/stats
+        Returns item counts per store and catalog totals.
+        """
+        return self.client.get("/store/stats")
+
+    def get_store(self, name, limit=None, after=None):
+        """
+        GET /store/<name>
+        Returns one store with a page of its items and its item count.
+        iter_store_items() follows the pages of items.
+        """
+        params = {k: v for k, v in {"limit": limit, "after": after}.items() if v is not None}
+        return self.client.get(f"/store/{name}", params=params)
+
+    def iter_store_items(self, name, page_size=None):
+        """
+        GET /store/<name>
+        Yields every item of a store, one page at a time.
+        """
+        params = {"limit": page_size} if page_size else {}
+        return self.client.iter_pages(f"/store/{name}", params=params, key="items")
+
+    def get_item(self, store_name, item_name):
+        """
+        GET /store/<store_name>/item/<item_name>
+        Returns one item of a store.
+        """
+        return self.client.get(f"/store/{store_name}/item/{item_name}")
+
+    def search_items(self, cidr, limit=None, after=None):
+        """
+        GET /item/?cidr=<prefix>
+        Returns one page of items (with their store) whose IP or prefix
+        overlaps the prefix; iter_search_items() follows the pages.
+        """
+        params = {"cidr": cidr, "limit": limit, "after": after}
+        return self.client.get("/item/", params={k: v for k, v in params.items() if v is not None})
+
+    def iter_search_items(self, cidr, page_size=None):
+        """
+        GET /item/?cidr=<prefix>
+        Yields every item whose IP or prefix overlaps the prefix, in address order.
+        """
+        params = {"cidr": cidr, "limit": page_size}
+        return self.client.iter_pages("/item/", params={k: v for k, v in params.items() if v is not None})
+
+    def lookup_ip(self, ip):
+        """
+        GET /lookup/ip/<ip>
+        Returns the items (and stores) owning the most specific prefix of ip.
+        """
+        return self.client.get(f"/lookup/ip/{ip}")
+
+    def lookup_ips(self, ips):
+        """
+        POST /lookup/ip
+        Batch variant of lookup_ip; one result per input, in order.
+        """
+        return self.client.post("/lookup/ip", json={"ips": list(ips)})
 
     def create_store(self, name):
         """
@@ -19,22 +114,50 @@ class StoreAPI:
         """
         return self.client.post("/store/", json={"name": name})
 
-    def create_item(self, store_name, name, ip):
+    def create_stores(self, names):
+        """
+        POST /store/bulk
+        Creates many stores in one transaction; reports created/duplicate
+        status per name.
+        """
+        return self.client.post("/store/bulk", json=[{"name": n} for n in names])
+
+    def create_item(self, store_name, name, ip, idempotency_key=None):
         """
         POST /store/<store_name>/item
-        Creates a new item inside a store.
+        Creates a new item inside a store. Retrying with the same
+        idempotency_key replays the first response instead of adding the
+        item twice.
         """
         return self.client.post(
             f"/store/{store_name}/item",
-            json={"name": name, "ip": ip}
+            json={"name": name, "ip": ip},
+            idempotency_key=idempotency_key,
+        )
+
+    def import_items(self, store_name, body, content_type="application/x-ndjson", background=False):
+        """
+        POST /store/<store_name>/items/bulk
+        Streams NDJSON or CSV (name,ip) items into a store. `body` may be
+        bytes, a file object or an iterator of bytes. With background=True
+        the server answers 202 with a job (see JobsAPI) once it has the body.
+        """
+        params = {"mode": "background"} if background else {}
+        return self.client.post(
+            f"/store/{store_name}/items/bulk",
+            data=body,
+            params=params,
+            headers={"Content-Type": content_type},
         )
 
-    def delete_store(self, name):
+    def delete_store(self, name, background=False):
         """
         DELETE /store/<name>
-        Deletes a store.
+        Deletes a store. With background=True the server answers 202 with a
+        job (see JobsAPI) and removes the items in batches afterwards.
         """
-        return self.client.delete(f"/store/{name}")
+        params = {"mode": "background"} if background else {}
+        return self.client.delete(f"/store/{name}", params=params)
 
     def rename_store(self, old_name, new_name):
         """
@@ -0,0 +1,50 @@
+import re
+from collections import namedtuple
+
+SQLiteProfile = namedtuple("SQLiteProfile", "pragmas immediate_writes")
+
+PROFILES = {
+    # SQLite's own defaults: rollback journal, synchronous=FULL, no lock
+    # waiting, every transaction DEFERRED.
+    "default": SQLiteProfile({}, False),
+    # For several processes sharing one database file. WAL lets readers run
+    # alongside the writer; busy_timeout makes lock conflicts wait instead of
+    # failing with "database is locked"; synchronous=NORMAL fsyncs at
+    # checkpoints only (safe against process crashes, a power loss can lose
+    # the last commits); mmap and a 64 MiB page cache serve reads from memory.
+    "wal": SQLiteProfile({
+        "journal_mode": "WAL",
+        "busy_timeout": 5000,
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+    }, True),
+}
+
+_PRAGMA_NAME = re.compile(r"^[a-z_]+$")
+_PRAGMA_VALUE = re.compile(r"^-?\w+$")
+
+
+def parse_pragmas(spec):
+    """Parse "name=value,name=value" (e.g. from an env var) into a dict."""
+    pragmas = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, value = entry.partition("=")
+        name, value = name.strip().lower(), value.strip()
+        if not sep or not _PRAGMA_NAME.match(name) or not _PRAGMA_VALUE.match(value):
+            raise ValueError(f"invalid SQLite pragma: {entry!r}")
+        pragmas[name] = value
+    return pragmas
+
+
+def get_profile(name, overrides=None):
+    """The named profile with `overrides` merged into its pragmas."""
+    if name not in PROFILES:
+        raise ValueError(f"unknown SQLite profile: {name} (available: {', '.join(PROFILES)})")
+    profile = PROFILES[name]
+    return profile._replace(pragmas={**profile.pragmas, **(overrides or {})})
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    for name, value in pragmas.items():
+        dbapi_connection.execute(f"PRAGMA {name}={value}")
@@ -1,14 +1,21 @@
+import json
+import os
+import threading
 import pytest
-from app import app, db, Store
+from app import app, db, Store, response_cache, catalog_stats_memo, job_runner, migrator, refresh_ip_index
 
+# conftest.py points app.py at a scratch database (or TEST_DATABASE_URI).
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    migrator.wait()
     with app.test_client() as client:
         with app.app_context():
             db.drop_all()
             db.create_all()
+            refresh_ip_index(force=True)
+        response_cache.clear()
+        catalog_stats_memo.clear()
         yield client
 
 def test_create_store(client):
@@ -22,3 +29,973 @@ def test_get_stores(client):
     assert response.status_code == 200
     assert any(store["name"] == "TestStore" for store in response.get_json()["stores"])
 
+
+
+def _auth(client, username, password):
+    response = client.post("/api/auth/login", json={"username": username, "password": password})
+    return {"Authorization": f"Bearer {response.get_json()['access_token']}"}
+
+@pytest.fixture
+def writer(client):
+    return _auth(client, "bob", "writerpass")
+
+def test_store_list_keyset_pagination(client, writer):
+    for n in range(5):
+        client.post("/api/store/", json={"name": f"Store{n}"}, headers=writer)
+    client.post("/api/store/Store0/item", json={"name": "Router", "ip": "10.0.0.1"}, headers=writer)
+
+    first = client.get("/api/store/?limit=2", headers=writer)
+    assert first.status_code == 200
+    assert [s["name"] for s in first.get_json()] == ["Store0", "Store1"]
+    assert first.get_json()[0]["items"] == [{"name": "Router", "ip": "10.0.0.1"}]
+
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(f"/api/store/?limit=2&after={cursor}", headers=writer)
+    assert [s["name"] for s in second.get_json()] == ["Store2", "Store3"]
+
+    last = client.get(f"/api/store/?limit=2&after={second.headers['X-Next-Cursor']}", headers=writer)
+    assert [s["name"] for s in last.get_json()] == ["Store4"]
+    assert "X-Next-Cursor" not in last.headers
+
+def test_store_list_rejects_bad_limit(client, writer):
+    assert client.get("/api/store/?limit=0", headers=writer).status_code == 400
+
+def test_store_export_streams_ndjson(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "Router", "ip": "10.0.0.1"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "Switch", "ip": "10.0.0.2"}, headers=writer)
+
+    response = client.get("/api/store/export.ndjson", headers=writer)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [
+        {"name": "A", "items": [{"name": "Router", "ip": "10.0.0.1"}, {"name": "Switch", "ip": "10.0.0.2"}]},
+        {"name": "B", "items": []},
+    ]
+
+def test_store_list_sparse_fields_and_embed(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "Router", "ip": "10.0.0.1"}, headers=writer)
+
+    names = client.get("/api/store/?fields=name", headers=writer).get_json()
+    assert names == [{"name": "A"}, {"name": "B"}]
+
+    counts = client.get("/api/store/?embed=count", headers=writer).get_json()
+    assert counts == [{"name": "A", "item_count": 1}, {"name": "B", "item_count": 0}]
+
+    bare = client.get("/api/store/?embed=none", headers=writer).get_json()
+    assert bare == [{"name": "A"}, {"name": "B"}]
+
+    assert client.get("/api/store/?fields=bogus", headers=writer).status_code == 400
+    assert client.get("/api/store/?embed=all", headers=writer).status_code == 400
+    assert client.get("/api/store/?fields=items&embed=count", headers=writer).status_code == 400
+    assert client.get("/api/store/?fields=name,items&embed=count", headers=writer).get_json() == [
+        {"name": "A"}, {"name": "B"}]
+
+def test_store_list_conditional_get(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    first = client.get("/api/store/", headers=writer)
+    etag = first.headers["ETag"]
+
+    cached = client.get("/api/store/", headers={**writer, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+
+    client.post("/api/store/A/item", json={"name": "Router", "ip": "10.0.0.1"}, headers=writer)
+    fresh = client.get("/api/store/", headers={**writer, "If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["ETag"] != etag
+
+def test_store_list_response_cache(client, writer):
+    admin = _auth(client, "admin", "adminpass")
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+
+    before = client.get("/api/cache/stats", headers=admin).get_json()
+    first = client.get("/api/store/?fields=name", headers=writer)
+    second = client.get("/api/store/?fields=name", headers=writer)
+    assert second.get_data() == first.get_data()
+    stats = client.get("/api/cache/stats", headers=admin).get_json()
+    assert stats["misses"] == before["misses"] + 1
+    assert stats["hits"] == before["hits"] + 1
+
+    client.put("/api/store/A", json={"name": "B"}, headers=writer)
+    assert client.get("/api/store/?fields=name", headers=writer).get_json() == [{"name": "B"}]
+
+def test_cached_read_between_commit_and_invalidation(client, writer, monkeypatch):
+    import app as app_module
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    stale = client.get("/api/store/?fields=name", headers=writer)
+
+    # A GET landing after the write's commit but before its invalidate_reads().
+    monkeypatch.setattr(app_module, "invalidate_reads", lambda *stores: None)
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+    fresh = client.get("/api/store/?fields=name", headers=writer)
+    assert fresh.get_json() == [{"name": "A"}, {"name": "B"}]
+    assert fresh.headers["ETag"] != stale.headers["ETag"]
+
+def test_cache_stats_requires_admin(client, writer):
+    assert client.get("/api/cache/stats", headers=writer).status_code == 403
+
+def test_sqlite_cache_invalidation_reaches_other_replica(tmp_path):
+    from cache import SQLiteResponseCache
+    path = str(tmp_path / "cache.db")
+    replica_1, replica_2 = SQLiteResponseCache(path), SQLiteResponseCache(path)
+
+    replica_1.set("/api/store/?", (b"[]", [("Content-Type", "application/json")]), ["stores"],
+                  replica_1.generation())
+    assert replica_2.get("/api/store/?") == (b"[]", [("Content-Type", "application/json")])
+
+    stale_generation = replica_1.generation()
+    replica_2.invalidate("stores")
+    assert replica_1.get("/api/store/?") is None
+    replica_1.set("/api/store/?", (b"old", []), ["stores"], stale_generation)
+    assert replica_2.get("/api/store/?") is None
+
+def test_sqlite_cache_fill_rolls_back_on_error(tmp_path):
+    from cache import SQLiteResponseCache
+    cache = SQLiteResponseCache(str(tmp_path / "cache.db"))
+    with pytest.raises(Exception):
+        # The tag cannot be bound, after the entry itself has been written.
+        cache.set("/api/store/?", (b"[]", []), [object()], cache.generation())
+    assert cache.get("/api/store/?") is None
+    assert cache.stats()["entries"] == 0
+
+
+class _RESPStandIn:
+    """In-process server speaking the subset of RESP2 RedisResponseCache uses."""
+    def __init__(self):
+        import socketserver
+        self.data, self.versions, self.lock = {}, {}, threading.Lock()
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                watched, queued = {}, None
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    args = []
+                    for _ in range(int(line[1:])):
+                        length = int(self.rfile.readline()[1:])
+                        args.append(self.rfile.read(length + 2)[:-2])
+                    command = args[0].decode().upper()
+                    if command == "WATCH":
+                        watched.update({k: stand_in.versions.get(k, 0) for k in args[1:]})
+                        reply = "OK"
+                    elif command == "UNWATCH":
+                        watched, reply = {}, "OK"
+                    elif command == "MULTI":
+                        queued, reply = [], "OK"
+                    elif command == "EXEC":
+                        with stand_in.lock:
+                            if any(stand_in.versions.get(k, 0) != v for k, v in watched.items()):
+                                reply = None
+                            else:
+                                reply = [stand_in.run(*cmd) for cmd in queued]
+                        watched, queued = {}, None
+                    elif queued is not None:
+                        queued.append(args)
+                        reply = "QUEUED"
+                    else:
+                        with stand_in.lock:
+                            reply = stand_in.run(*args)
+                    self.wfile.write(_resp(reply))
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "redis://127.0.0.1:%d/0" % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def run(self, command, *args):
+        import fnmatch
+        command = command.decode().upper()
+        if command == "GET":
+            return self.data.get(args[0])
+        if command == "SET":
+            self.data[args[0]] = args[1]
+            self._touch(args[0])
+            return "OK"
+        if command == "INCR":
+            self.data[args[0]] = b"%d" % (int(self.data.get(args[0], 0)) + 1)
+            self._touch(args[0])
+            return int(self.data[args[0]])
+        if command == "SADD":
+            self.data.setdefault(args[0], set()).update(args[1:])
+            self._touch(args[0])
+            return len(args) - 1
+        if command == "SMEMBERS":
+            return sorted(self.data.get(args[0], ()))
+        if command == "DEL":
+            for key in args:
+                self._touch(key)
+            return sum(self.data.pop(key, None) is not None for key in args)
+        if command == "EXPIRE":
+            return 1
+        if command == "SCAN":
+            pattern = args[args.index(b"MATCH") + 1].decode()
+            return [b"0", [k for k in self.data if fnmatch.fnmatchcase(k.decode(), pattern)]]
+        raise ValueError(command)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _resp(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_resp(v) for v in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def test_redis_cache_against_resp_stand_in():
+    from cache import RedisResponseCache
+    server = _RESPStandIn()
+    try:
+        replica_1, replica_2 = RedisResponseCache(server.url), RedisResponseCache(server.url)
+        value = (b"[]", [("Content-Type", "application/json")])
+        replica_1.set("/api/store/?", value, ["stores"], replica_1.generation())
+        assert replica_2.get("/api/store/?") == value
+
+        replica_2.invalidate("stores")
+        assert replica_1.get("/api/store/?") is None
+
+        # An invalidation between WATCH and EXEC aborts the fill.
+        execute = replica_1._execute
+
+        def racing(*args):
+            if args[0] == "MULTI":
+                replica_2.invalidate("stores")
+            return execute(*args)
+        replica_1._execute = racing
+        replica_1.set("/api/store/?", value, ["stores"], replica_1.generation())
+        replica_1._execute = execute
+        assert replica_2.get("/api/store/?") is None
+
+        replica_1.set("/api/store/A", value, ["store:A"], replica_1.generation())
+        replica_2.clear()
+        assert replica_1.get("/api/store/A") is None
+    finally:
+        server.close()
+
+def test_unreachable_cache_backend_does_not_fail_requests(client, writer, monkeypatch):
+    import app as app_module
+    from cache import RedisResponseCache
+    # Nothing listens on port 1: every cache call fails to connect.
+    monkeypatch.setattr(app_module, "response_cache", RedisResponseCache("redis://127.0.0.1:1/0"))
+
+    create = client.post("/api/store/", json={"name": "A"}, headers={**writer, "Idempotency-Key": "k1"})
+    assert create.status_code == 201
+    retry = client.post("/api/store/", json={"name": "A"}, headers={**writer, "Idempotency-Key": "k1"})
+    assert retry.status_code == 201
+    assert client.get("/api/store/?fields=name", headers=writer).get_json() == [{"name": "A"}]
+
+    assert client.put("/api/store/A", json={"name": "B"}, headers=writer).status_code == 200
+    assert client.get("/api/store/?fields=name", headers=writer).get_json() == [{"name": "B"}]
+    assert client.get("/api/store/B", headers=writer).status_code == 200
+
+def test_get_single_store_paginates_items(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    for n in range(3):
+        client.post("/api/store/A/item", json={"name": f"Item{n}", "ip": f"10.0.0.{n}"}, headers=writer)
+
+    first = client.get("/api/store/A?limit=2", headers=writer)
+    assert first.status_code == 200
+    assert first.get_json() == {
+        "name": "A",
+        "items": [{"name": "Item0", "ip": "10.0.0.0"}, {"name": "Item1", "ip": "10.0.0.1"}],
+        "item_count": 3,
+    }
+    rest = client.get(f"/api/store/A?limit=2&after={first.headers['X-Next-Cursor']}", headers=writer)
+    assert rest.get_json()["items"] == [{"name": "Item2", "ip": "10.0.0.2"}]
+    assert "X-Next-Cursor" not in rest.headers
+
+    missing = client.get("/api/store/Nope", headers=writer)
+    assert missing.status_code == 404
+    assert missing.get_json()["message"] == "store not found"
+
+def test_get_single_item(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "Router", "ip": "10.0.0.1"}, headers=writer)
+
+    response = client.get("/api/store/A/item/Router", headers=writer)
+    assert response.status_code == 200
+    assert response.get_json() == {"name": "Router", "ip": "10.0.0.1"}
+    assert client.get("/api/store/A/item/Switch", headers=writer).status_code == 404
+
+    client.post("/api/store/A/item", json={"name": "Switch", "ip": "10.0.0.2"}, headers=writer)
+    assert client.get("/api/store/A/item/Switch", headers=writer).status_code == 200
+
+def test_item_cidr_search(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+    for store, name, ip in [("A", "r1", "10.20.3.4"), ("B", "r2", "10.20.0.1"), ("A", "r3", "10.21.0.1"),
+                            ("B", "r4", "2001:db8::1"), ("A", "r5", "not-an-ip")]:
+        client.post(f"/api/store/{store}/item", json={"name": name, "ip": ip}, headers=writer)
+
+    first = client.get("/api/item/?cidr=10.20.0.0/16&limit=1", headers=writer)
+    assert first.status_code == 200
+    assert first.get_json() == [{"name": "r2", "ip": "10.20.0.1", "store": "B"}]
+    rest = client.get(f"/api/item/?cidr=10.20.0.0/16&after={first.headers['X-Next-Cursor']}", headers=writer)
+    assert rest.get_json() == [{"name": "r1", "ip": "10.20.3.4", "store": "A"}]
+
+    v6 = client.get("/api/item/?cidr=2001:db8::/32", headers=writer).get_json()
+    assert [i["name"] for i in v6] == ["r4"]
+    assert client.get("/api/item/?cidr=10.300.0.0/16", headers=writer).status_code == 400
+
+    # A prefix item overlaps a search it lies in or contains.
+    client.post("/api/store/A/item", json={"name": "p1", "ip": "172.16.0.0/16"}, headers=writer)
+    client.post("/api/store/B/item", json={"name": "p2", "ip": "10.0.0.0/8"}, headers=writer)
+    def search(cidr):
+        names, url = [], f"/api/item/?cidr={cidr}&limit=1"
+        while True:
+            response = client.get(url, headers=writer)
+            names += [i["name"] for i in response.get_json()]
+            if "X-Next-Cursor" not in response.headers:
+                return names
+            url = f"/api/item/?cidr={cidr}&limit=1&after={response.headers['X-Next-Cursor']}"
+    assert search("172.16.0.0/12") == ["p1"]
+    assert search("172.16.5.0/24") == ["p1"]
+    assert search("172.17.0.0/16") == []
+    assert search("10.20.0.0/16") == ["p2", "r2", "r1"]
+
+def test_prefix_item_ranges_are_backfilled(client, writer):
+    from migrations import Migration, Migrator
+    from app import Item, SchemaMigration, backfill_item_ip_ranges
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "p1", "ip": "172.16.0.0/16"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "r1", "ip": "172.16.0.1"}, headers=writer)
+    with app.app_context():
+        # As written before migration 7: prefixes without ip_bin, nothing in ip_bin_end.
+        db.session.execute(db.update(Item).values(ip_bin_end=None))
+        db.session.execute(db.update(Item).where(Item.name == "p1").values(ip_bin=None))
+        db.session.commit()
+        migration = Migration(100, "test ip ranges", backfill_item_ip_ranges, online=True)
+        Migrator(app, db, SchemaMigration, [migration], batch_pause=0).apply(migration)
+    response_cache.clear()
+    found = client.get("/api/item/?cidr=172.16.0.0/12", headers=writer).get_json()
+    assert [i["name"] for i in found] == ["p1", "r1"]
+
+def test_ip_lookup_longest_prefix_match(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "lan", "ip": "10.20.0.0/16"}, headers=writer)
+    client.post("/api/store/B/item", json={"name": "router", "ip": "10.20.3.4"}, headers=writer)
+
+    exact = client.get("/api/lookup/ip/10.20.3.4", headers=writer)
+    assert exact.status_code == 200
+    assert exact.get_json() == {
+        "ip": "10.20.3.4", "prefix": "10.20.3.4/32",
+        "owners": [{"store": "B", "item": "router", "ip": "10.20.3.4"}],
+    }
+    assert client.get("/api/lookup/ip/10.20.9.9", headers=writer).get_json()["prefix"] == "10.20.0.0/16"
+    assert client.get("/api/lookup/ip/10.21.0.1", headers=writer).status_code == 404
+
+    client.put("/api/store/B", json={"name": "C"}, headers=writer)
+    batch = client.post("/api/lookup/ip", json={"ips": ["10.20.3.4", "bogus"]}, headers=writer).get_json()
+    assert batch[0]["owners"][0]["store"] == "C"
+    assert batch[1] == {"ip": "bogus", "error": "invalid ip"}
+
+def test_ip_index_applies_out_of_order_writes_in_version_order():
+    from ipindex import IPOwnershipIndex
+    index = IPOwnershipIndex()
+    index.build([], 0)
+    index.apply(2, index.add, "A", "second", "10.0.0.2")
+    assert index.version == 0 and index.lookup("10.0.0.2") is None
+    index.apply(1, index.add, "A", "first", "10.0.0.1")
+    assert (index.version, index.stale) == (2, False)
+    assert index.lookup("10.0.0.2")["owners"][0]["item"] == "second"
+
+    # A version this process never sees (another replica's write) waits for
+    # the next build, which already contains it.
+    index.apply(4, index.add, "A", "fourth", "10.0.0.4")
+    index.build([("A", "first", "10.0.0.1"), ("A", "second", "10.0.0.2"), ("B", "third", "10.0.0.3")], 3)
+    assert index.version == 4 and index.lookup("10.0.0.4") is not None
+
+def test_ip_lookups_stay_off_the_database_under_concurrent_writes(client, writer):
+    from app import ip_index, catalog_version
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+
+    def create(thread):
+        with app.test_client() as own:
+            for n in range(5):
+                own.post("/api/store/A/item", json={"name": f"i{thread}-{n}", "ip": f"10.{thread}.0.{n}"},
+                         headers=writer)
+    threads = [threading.Thread(target=create, args=(t,)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        assert (ip_index.version, ip_index.stale) == (catalog_version(), False)
+
+    statements = []
+    capture = lambda *args: statements.append(args[2])
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        db.event.listen(engine, "before_cursor_execute", capture)
+    try:
+        assert client.get("/api/lookup/ip/10.7.0.4", headers=writer).get_json()["owners"][0]["item"] == "i7-4"
+        assert client.post("/api/lookup/ip", json={"ips": ["10.3.0.0"]}, headers=writer).status_code == 200
+    finally:
+        for engine in engines:
+            db.event.remove(engine, "before_cursor_execute", capture)
+    assert statements == []
+
+def test_reserved_store_names_are_rejected(client, writer):
+    assert client.post("/api/store/", json={"name": "stats"}, headers=writer).status_code == 400
+    bulk = client.post("/api/store/bulk", json=[{"name": "export.ndjson"}, {"name": "A"}], headers=writer)
+    assert [r["status"] for r in bulk.get_json()["results"]] == ["invalid", "created"]
+    assert client.put("/api/store/A", json={"name": "stats"}, headers=writer).status_code == 400
+    assert client.get("/api/store/stats", headers=writer).get_json()["total_stores"] == 1
+
+def test_store_stats(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+    for name, ip in [("r1", "10.0.0.1"), ("r2", "10.0.0.1"), ("r3", "10.0.0.2")]:
+        client.post("/api/store/A/item", json={"name": name, "ip": ip}, headers=writer)
+
+    stats = client.get("/api/store/stats", headers=writer).get_json()
+    assert stats["total_stores"] == 2
+    assert stats["total_items"] == 3
+    assert stats["distinct_ips"] == 2
+    assert stats["stores"] == [
+        {"name": "A", "item_count": 3, "distinct_ips": 2},
+        {"name": "B", "item_count": 0, "distinct_ips": 0},
+    ]
+
+    client.post("/api/store/B/item", json={"name": "r4", "ip": "10.0.0.9"}, headers=writer)
+    assert client.get("/api/store/stats", headers=writer).get_json()["total_items"] == 4
+
+def test_bulk_store_create(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    response = client.post("/api/store/bulk", headers=writer,
+                           json=[{"name": "A"}, {"name": "B"}, {"name": "C"}, {"name": "B"}, {"name": ""}])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r["status"] for r in body["results"]] == ["duplicate", "created", "created", "duplicate", "invalid"]
+    assert (body["created"], body["duplicate"], body["invalid"]) == (2, 2, 1)
+    names = [s["name"] for s in client.get("/api/store/?fields=name", headers=writer).get_json()]
+    assert names == ["A", "B", "C"]
+
+    rejected = client.post("/api/store/bulk", json={"name": "D"}, headers=writer)
+    assert rejected.status_code == 400
+    assert rejected.get_json() == {"message": "a JSON array of stores is required"}
+
+def test_bulk_item_import_ndjson_and_csv(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    ndjson = '{"name": "r1", "ip": "10.0.0.1"}\n\n{"name": "r2", "ip": "bogus"}\nnot json\n{"name": "r3", "ip": "10.1.0.0/16"}\n'
+    response = client.post("/api/store/A/items/bulk", data=ndjson,
+                           headers={**writer, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "accepted": 2, "rejected": 2, "errors_truncated": False,
+        "errors": [{"line": 3, "message": "ip must be an IP address or prefix"},
+                   {"line": 4, "message": "not a JSON object"}],
+    }
+
+    csv_body = "name,ip\nr4,10.0.0.4\n,10.0.0.5\n"
+    summary = client.post("/api/store/A/items/bulk", data=csv_body,
+                          headers={**writer, "Content-Type": "text/csv"}).get_json()
+    assert (summary["accepted"], summary["rejected"]) == (1, 1)
+
+    items = client.get("/api/store/A", headers=writer).get_json()["items"]
+    assert [i["name"] for i in items] == ["r1", "r3", "r4"]
+    assert client.get("/api/lookup/ip/10.1.2.3", headers=writer).get_json()["owners"][0]["item"] == "r3"
+    assert client.post("/api/store/A/items/bulk", data="x",
+                       headers={**writer, "Content-Type": "text/plain"}).status_code == 415
+
+def test_copy_items_payload_for_psycopg_cursors():
+    from app import copy_items
+    rows = [("r1", "10.0.0.1", 7), ('say "hi", ok', "10.1.0.0/16", 7), ("r3", "bogus", 7)]
+    expected = ('r1,10.0.0.1,\\x00000000000000000000ffff0a000001,\\x00000000000000000000ffff0a000001,7\r\n'
+                '"say ""hi"", ok",10.1.0.0/16,\\x00000000000000000000ffff0a010000,'
+                '\\x00000000000000000000ffff0a01ffff,7\r\n'
+                'r3,bogus,,,7\r\n')
+
+    class Psycopg2Cursor:
+        def copy_expert(self, sql, file):
+            self.sql, self.data = sql, file.read()
+
+    class Psycopg3Cursor:
+        def copy(self, sql):
+            self.sql, self.data = sql, ""
+            cursor = self
+            class Copy:
+                def __enter__(self):
+                    return self
+                def __exit__(self, *exc):
+                    return False
+                def write(self, data):
+                    cursor.data += data
+            return Copy()
+
+    for cursor in (Psycopg2Cursor(), Psycopg3Cursor()):
+        assert copy_items(cursor, rows) is True
+        assert cursor.sql == "COPY item (name, ip, ip_bin, ip_bin_end, store_id) FROM STDIN WITH (FORMAT csv)"
+        assert cursor.data == expected
+    assert copy_items(object(), rows) is False
+
+def test_store_writes_map_conflicts_to_400(client, writer):
+    assert client.post("/api/store/", json={"name": "A"}, headers=writer).status_code == 201
+    assert client.post("/api/store/", json={"name": "A"}, headers=writer).status_code == 400
+    client.post("/api/store/", json={"name": "B"}, headers=writer)
+
+    conflict = client.put("/api/store/A", json={"name": "B"}, headers=writer)
+    assert conflict.status_code == 400
+    assert conflict.get_json()["message"] == "a store with the new name already exists"
+    assert client.put("/api/store/Nope", json={"name": "C"}, headers=writer).status_code == 404
+    assert client.put("/api/store/A", json={"name": "C"}, headers=writer).get_json() == {
+        "name": "C", "items": [], "item_count": 0}
+
+    created = client.post("/api/store/C/item", json={"name": "r1", "ip": "10.0.0.1"}, headers=writer)
+    assert (created.status_code, created.get_json()) == (201, {"name": "r1", "ip": "10.0.0.1"})
+    assert client.post("/api/store/A/item", json={"name": "r1", "ip": "10.0.0.1"}, headers=writer).status_code == 404
+    assert client.get("/api/item/?cidr=10.0.0.0/24", headers=writer).get_json()[0]["store"] == "C"
+    assert client.post("/api/store/", json={"name": "C"}, headers=writer).get_json() == {"message": "store exists"}
+
+def test_rename_returns_count_and_first_page(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    for n in range(3):
+        client.post("/api/store/A/item", json={"name": f"Item{n}", "ip": f"10.0.0.{n}"}, headers=writer)
+
+    renamed = client.put("/api/store/A?limit=2", json={"name": "B"}, headers=writer)
+    assert renamed.status_code == 200
+    assert renamed.get_json()["item_count"] == 3
+    assert [i["name"] for i in renamed.get_json()["items"]] == ["Item0", "Item1"]
+    assert "X-Next-Cursor" in renamed.headers
+    assert client.get("/api/store/A", headers=writer).status_code == 404
+
+    # A bad page argument is rejected before the rename, not after it.
+    assert client.put("/api/store/B?limit=0", json={"name": "C"}, headers=writer).status_code == 400
+    assert client.get("/api/store/B", headers=writer).status_code == 200
+    assert client.get("/api/store/C", headers=writer).status_code == 404
+
+def test_delete_store_cascades_in_database(client, writer):
+    admin = _auth(client, "admin", "adminpass")
+    for store in ("A", "B"):
+        client.post("/api/store/", json={"name": store}, headers=writer)
+        client.post(f"/api/store/{store}/item", json={"name": "r1", "ip": "10.0.0.1"}, headers=writer)
+
+    assert client.delete("/api/store/A", headers=admin).status_code == 200
+    assert client.delete("/api/store/A", headers=admin).status_code == 404
+    with app.app_context():
+        assert db.session.execute(db.text("SELECT COUNT(*) FROM item")).scalar() == 1
+
+def test_delete_store_in_background(client, writer):
+    admin = _auth(client, "admin", "adminpass")
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    for n in range(3):
+        client.post("/api/store/A/item", json={"name": f"r{n}", "ip": f"10.0.0.{n}"}, headers=writer)
+
+    response = client.delete("/api/store/A?mode=background", headers=admin)
+    assert response.status_code == 202
+    job_id = response.get_json()["id"]
+    assert response.headers["Location"] == f"/api/jobs/{job_id}"
+    job_runner.wait(job_id, timeout=10)
+    job = client.get(f"/api/jobs/{job_id}", headers=admin).get_json()
+    assert (job["status"], job["progress"]) == ("succeeded", {"done": 3, "total": 3})
+    assert client.get("/api/store/A", headers=writer).status_code == 404
+    assert client.get("/api/lookup/ip/10.0.0.1", headers=writer).status_code == 404
+
+def test_store_jobs_follow_a_rename_made_before_they_run(client, writer, monkeypatch):
+    admin = _auth(client, "admin", "adminpass")
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "r0", "ip": "10.0.0.1"}, headers=writer)
+
+    renamed = threading.Event()
+    for kind in ("import_items", "delete_store"):
+        handler = job_runner.handlers[kind]
+        monkeypatch.setitem(job_runner.handlers, kind,
+                            lambda ctx, handler=handler: renamed.wait(10) and handler(ctx))
+
+    queued = client.post("/api/store/A/items/bulk?mode=background", data='{"name": "r1", "ip": "10.0.0.2"}\n',
+                         headers={**writer, "Content-Type": "application/x-ndjson"})
+    client.put("/api/store/A", json={"name": "B"}, headers=writer)
+    renamed.set()
+    job_runner.wait(queued.get_json()["id"], timeout=10)
+    assert client.get("/api/lookup/ip/10.0.0.2", headers=writer).get_json()["owners"][0]["store"] == "B"
+
+    renamed.clear()
+    deleting = client.delete("/api/store/B?mode=background", headers=admin)
+    client.put("/api/store/B", json={"name": "C"}, headers=writer)
+    renamed.set()
+    job_runner.wait(deleting.get_json()["id"], timeout=10)
+    assert client.get("/api/store/C", headers=writer).status_code == 404
+    assert client.get("/api/lookup/ip/10.0.0.1", headers=writer).status_code == 404
+    assert client.get("/api/lookup/ip/10.0.0.2", headers=writer).status_code == 404
+
+def test_group_committer_batches_concurrent_writes():
+    from groupcommit import GroupCommitter
+    batches = []
+    committer = GroupCommitter(lambda payloads: batches.append(payloads) or [p * 2 for p in payloads],
+                               max_batch=10, max_wait=0.05)
+    futures = [committer.submit(n) for n in range(25)]
+    assert [f.result(timeout=5) for f in futures] == [n * 2 for n in range(25)]
+    committer.close()
+    assert [len(b) for b in batches] == [10, 10, 5]
+
+def test_item_create_with_group_commit(client, writer):
+    import threading
+    from app import enable_item_group_commit, disable_item_group_commit
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    committer = enable_item_group_commit(max_batch=16, max_wait=0.05)
+    try:
+        statuses = []
+        def create(n):
+            with app.test_client() as c:
+                r = c.post("/api/store/A/item", json={"name": f"r{n}", "ip": f"10.0.0.{n}"}, headers=writer)
+                statuses.append(r.status_code)
+        threads = [threading.Thread(target=create, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        missing = client.post("/api/store/Nope/item", json={"name": "x", "ip": "10.0.0.1"}, headers=writer)
+    finally:
+        disable_item_group_commit()
+
+    assert statuses == [201] * 8
+    assert missing.status_code == 404
+    assert committer.batches < committer.writes
+    assert client.get("/api/store/A", headers=writer).get_json()["item_count"] == 8
+
+def test_export_and_import_jobs(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    body = '{"name": "r1", "ip": "10.0.0.1"}\n{"name": "r2", "ip": "bogus"}\n'
+    queued = client.post("/api/store/A/items/bulk?mode=background", data=body,
+                         headers={**writer, "Content-Type": "application/x-ndjson"})
+    assert (queued.status_code, queued.get_json()["kind"]) == (202, "import_items")
+    job_runner.wait(queued.get_json()["id"], timeout=10)
+    imported = client.get(queued.headers["Location"], headers=writer).get_json()
+    assert imported["status"] == "succeeded"
+    assert (imported["result"]["accepted"], imported["result"]["rejected"]) == (1, 1)
+
+    export = client.post("/api/jobs", json={"kind": "export"}, headers=writer)
+    assert export.status_code == 202
+    job_runner.wait(export.get_json()["id"], timeout=10)
+    job = client.get(export.headers["Location"], headers=writer).get_json()
+    assert job["status"] == "succeeded" and job["progress"] == {"done": 1, "total": 1}
+    lines = client.get(job["result_location"], headers=writer).get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [{"name": "A", "items": [{"name": "r1", "ip": "10.0.0.1"}]}]
+
+    reader = _auth(client, "alice", "readerpass")
+    assert client.get(export.headers["Location"], headers=reader).status_code == 404
+    assert client.post("/api/jobs", json={"kind": "delete_store", "params": {"store": "A"}},
+                       headers=writer).status_code == 403
+    assert client.post("/api/jobs", json={"kind": "nope"}, headers=writer).status_code == 400
+
+def test_idempotency_key_fingerprints_upload_bodies(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    upload = {**writer, "Content-Type": "application/x-ndjson", "Idempotency-Key": "import-1"}
+    first = client.post("/api/store/A/items/bulk", data=b'{"name": "r1", "ip": "10.0.0.1"}\n', headers=upload)
+    assert (first.status_code, first.get_json()["accepted"]) == (200, 1)
+    again = client.post("/api/store/A/items/bulk", data=b'{"name": "r1", "ip": "10.0.0.1"}\n', headers=upload)
+    assert again.headers["Idempotent-Replayed"] == "true"
+    # Same length, different rows.
+    other = client.post("/api/store/A/items/bulk", data=b'{"name": "r2", "ip": "10.0.0.2"}\n', headers=upload)
+    assert other.status_code == 422
+    assert client.get("/api/store/A", headers=writer).get_json()["item_count"] == 1
+
+def test_jobs_of_a_dead_worker_are_reclaimed(client, writer, monkeypatch):
+    import time
+    import app as app_module
+    from app import Job, job_file, new_job_id
+    from jobs import utcnow
+    monkeypatch.setattr(app_module, "ITEM_IMPORT_CHUNK_SIZE", 2)
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "r0", "ip": "10.0.0.0"}, headers=writer)
+    client.post("/api/store/A/item", json={"name": "r1", "ip": "10.0.0.1"}, headers=writer)
+
+    def orphan(attempts, done):
+        # A running job whose worker died after committing `done` rows.
+        job_id = new_job_id()
+        with open(job_file(job_id, "upload"), "w") as spool:
+            spool.writelines(f'{{"name": "r{n}", "ip": "10.0.0.{n}"}}\n' for n in range(5))
+        with app.app_context():
+            store_id = db.session.execute(db.select(Store.id).where(Store.name == "A")).scalar()
+            db.session.add(Job(id=job_id, kind="import_items", status="running",
+                               created_by="bob", created_at=utcnow(),
+                               params={"store": "A", "store_id": store_id,
+                                       "content_type": "application/x-ndjson"},
+                               progress_done=done, attempts=attempts, lease_until=time.time() - 1))
+            db.session.commit()
+        return job_id
+
+    resumed, given_up = orphan(attempts=1, done=2), orphan(attempts=3, done=0)
+    with app.app_context():
+        job_runner.resume()
+    job_runner.wait(resumed, timeout=10)
+
+    job = client.get(f"/api/jobs/{resumed}", headers=writer).get_json()
+    assert job["status"] == "succeeded" and job["result"]["accepted"] == 5
+    # The two rows committed before the crash are not imported twice.
+    assert client.get("/api/store/A", headers=writer).get_json()["item_count"] == 5
+    job = client.get(f"/api/jobs/{given_up}", headers=writer).get_json()
+    assert job["status"] == "failed" and "abandoned" in job["error"]
+    assert not os.path.exists(job_file(given_up, "upload"))
+    assert not os.path.exists(job_file(resumed, "upload"))
+
+def test_idempotency_key_replays_first_response(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    retry = {**writer, "Idempotency-Key": "create-r1"}
+    first = client.post("/api/store/A/item", json={"name": "r1", "ip": "10.0.0.1"}, headers=retry)
+    again = client.post("/api/store/A/item", json={"name": "r1", "ip": "10.0.0.1"}, headers=retry)
+    assert (first.status_code, again.status_code) == (201, 201)
+    assert again.get_json() == first.get_json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.headers["X-Catalog-Version"] == first.headers["X-Catalog-Version"]
+    assert client.get("/api/store/A", headers=writer).get_json()["item_count"] == 1
+
+    reused = client.post("/api/store/A/item", json={"name": "r2", "ip": "10.0.0.2"}, headers=retry)
+    assert reused.status_code == 422
+    # Keys are per user.
+    admin = _auth(client, "admin", "adminpass")
+    other = client.post("/api/store/A/item", json={"name": "r1", "ip": "10.0.0.1"},
+                        headers={**admin, "Idempotency-Key": "create-r1"})
+    assert "Idempotent-Replayed" not in other.headers
+
+    from app import IdempotencyKey, purge_idempotency_keys
+    with app.app_context():
+        db.session.execute(db.update(IdempotencyKey).values(expires_at=0))
+        purge_idempotency_keys(1)
+        assert db.session.execute(db.select(db.func.count()).select_from(IdempotencyKey)).scalar() == 0
+
+def test_idempotency_claim_is_renewed_while_the_request_runs(client, writer, monkeypatch):
+    import time
+    import app as app_module
+    monkeypatch.setattr(app_module, "IDEMPOTENCY_LOCK_SECONDS", 1)
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+
+    started, release = threading.Event(), threading.Event()
+    import_item_stream = app_module.import_item_stream
+    def slow_import(*args, **kwargs):
+        # Ends the view's transaction first, as an import does between chunks,
+        # so the SQLite write lock is free while it waits.
+        db.session.commit()
+        started.set()
+        release.wait(10)
+        return import_item_stream(*args, **kwargs)
+    monkeypatch.setattr(app_module, "import_item_stream", slow_import)
+
+    headers = {**writer, "Idempotency-Key": "import-1", "Content-Type": "application/x-ndjson"}
+    body = '{"name": "r1", "ip": "10.0.0.1"}\n'
+    responses = []
+    def send():
+        with app.test_client() as own:
+            responses.append(own.post("/api/store/A/items/bulk", data=body, headers=headers))
+    first = threading.Thread(target=send)
+    first.start()
+    assert started.wait(10)
+    # Well past the lock time, the claim is still held: neither a retry nor
+    # the purge can take it over.
+    time.sleep(2.5)
+    with app.app_context():
+        app_module.purge_idempotency_keys(int(time.time()))
+    assert client.post("/api/store/A/items/bulk", data=body, headers=headers).status_code == 409
+
+    release.set()
+    first.join(10)
+    assert responses[0].status_code == 200
+    replay = client.post("/api/store/A/items/bulk", data=body, headers=headers)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert client.get("/api/store/A", headers=writer).get_json()["item_count"] == 1
+
+@pytest.mark.skipif(not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"),
+                    reason="SQLite connection profile")
+def test_sqlite_connections_use_profile():
+    from sqliteprofile import parse_pragmas
+    with app.app_context():
+        pragma = lambda name: db.session.execute(db.text(f"PRAGMA {name}")).scalar()
+        assert (pragma("journal_mode"), pragma("busy_timeout"), pragma("synchronous")) == ("wal", 5000, 1)
+        assert pragma("foreign_keys") == 1
+    assert parse_pragmas("busy_timeout=100, mmap_size=0") == {"busy_timeout": "100", "mmap_size": "0"}
+    with pytest.raises(ValueError):
+        parse_pragmas("journal_mode=WAL; DROP TABLE store")
+
+def _query_plans(client, headers, url):
+    """EXPLAIN QUERY PLAN of every SELECT a GET of `url` runs: {sql: [plan details]}."""
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT"):
+            statements.append((statement, parameters))
+    with app.app_context():
+        engine = db.engines.get("read", db.engine)
+    db.event.listen(engine, "before_cursor_execute", capture)
+    try:
+        assert client.get(url, headers=headers).status_code == 200
+    finally:
+        db.event.remove(engine, "before_cursor_execute", capture)
+    with app.app_context():
+        conn = db.session.connection().connection.driver_connection
+        return {sql: [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+                for sql, params in statements}
+
+@pytest.mark.skipif(not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"),
+                    reason="SQLite query plans")
+def test_endpoint_query_plans_use_indexes(client, writer):
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    for n in range(3):
+        client.post("/api/store/A/item", json={"name": f"r{n}", "ip": f"10.0.0.{n}"}, headers=writer)
+
+    urls = ["/api/store/", "/api/store/?embed=count", "/api/store/A", "/api/store/A?after=1",
+            "/api/store/A/item/r1", "/api/item/?cidr=10.0.0.0/24", "/api/store/stats",
+            "/api/store/export.ndjson"]
+    plans = {url: _query_plans(client, writer, url) for url in urls}
+    for url, statements in plans.items():
+        for sql, details in statements.items():
+            assert "SCAN item" not in details, (url, sql, details)
+            assert not any("TEMP B-TREE FOR" in d and "ORDER BY" in d for d in details), (url, sql, details)
+
+    page_plans = [d for details in plans["/api/store/A?after=1"].values() for d in details]
+    assert "SEARCH item USING INDEX ix_item_store_id (store_id=? AND rowid>?)" in page_plans
+    assert "SEARCH item USING INDEX ix_item_store_id_name (store_id=? AND name=?)" in \
+        [d for details in plans["/api/store/A/item/r1"].values() for d in details]
+
+def test_migration_backfill_resumes_after_interruption(client, writer):
+    from migrations import Migration, Migrator
+    from app import Item, SchemaMigration
+    from iputils import ip_to_bin
+    client.post("/api/store/", json={"name": "A"}, headers=writer)
+    for n in range(5):
+        client.post("/api/store/A/item", json={"name": f"r{n}", "ip": f"10.0.0.{n}"}, headers=writer)
+    with app.app_context():
+        db.session.execute(db.update(Item).values(ip_bin=None))
+        db.session.commit()
+
+    computed, interrupt = [], [True]
+    def compute(row):
+        if row.id == 4 and interrupt:
+            raise RuntimeError("interrupted")
+        computed.append(row.id)
+        return ip_to_bin(row.ip)
+    migration = Migration(100, "test backfill",
+                          lambda m: m.backfill(Item.__table__.c.ip_bin, compute, [Item.ip], batch_size=2),
+                          online=True)
+
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            Migrator(app, db, SchemaMigration, [migration], batch_pause=0).apply(migration)
+        record = db.session.get(SchemaMigration, 100)
+        assert (record.status, record.cursor) == ("failed", 2)
+
+        interrupt.clear()
+        # Another replica picks it up from the last committed batch.
+        replica = Migrator(app, db, SchemaMigration, [migration], batch_pause=0)
+        replica.apply(migration)
+        assert replica.status()[0]["status"] == "done"
+        assert computed == [1, 2, 3, 3, 4, 5]
+        assert db.session.execute(db.select(db.func.count(Item.ip_bin))).scalar() == 5
+
+def test_migration_lease_is_renewed_while_a_step_runs(client):
+    import time
+    from migrations import Migration, Migrator
+    from app import SchemaMigration
+    running, claimed_by_other = threading.Event(), []
+    other = Migrator(app, db, SchemaMigration, [], batch_pause=0)
+
+    def long_step():
+        running.set()
+        time.sleep(0.6)
+
+    migration = Migration(101, "test long step", lambda m: m.run(long_step), online=True)
+    owner = Migrator(app, db, SchemaMigration, [migration], batch_pause=0)
+    owner.LEASE_SECONDS = other.LEASE_SECONDS = 0.2
+
+    def contend():
+        running.wait(5)
+        with app.app_context():
+            for _ in range(4):
+                time.sleep(0.1)
+                claimed_by_other.append(other._claim(migration))
+            db.session.remove()
+    thread = threading.Thread(target=contend)
+    thread.start()
+    with app.app_context():
+        owner.apply(migration)
+    thread.join()
+    # Without the heartbeat the 0.2s lease would have expired mid-step.
+    assert claimed_by_other == [False] * 4
+
+@pytest.mark.skipif("read" not in app.config.get("SQLALCHEMY_BINDS", {}), reason="no read bind configured")
+def test_reads_use_read_only_bind_with_read_your_writes(client, writer):
+    with app.app_context():
+        primary, read = db.engine, db.engines["read"]
+    used = []
+    capture = {engine: (lambda engine: lambda *args: used.append(engine))(engine) for engine in (primary, read)}
+    for engine, listener in capture.items():
+        db.event.listen(engine, "before_cursor_execute", listener)
+    try:
+        created = client.post("/api/store/", json={"name": "A"}, headers=writer)
+        version = int(created.headers["X-Catalog-Version"])
+        assert set(used) == {primary}
+
+        used.clear()
+        assert client.get("/api/store/A", headers=writer).status_code == 200
+        assert set(used) == {read}
+
+        used.clear()
+        client.get("/api/store/?limit=5", headers={**writer, "X-Min-Catalog-Version": str(version)})
+        assert set(used) == {read}
+        # A read bind that is behind the client's last write is bypassed.
+        used.clear()
+        client.get("/api/store/?limit=6", headers={**writer, "X-Min-Catalog-Version": str(version + 1)})
+        assert used[-1] is primary
+
+        # Job status is read where the job is written.
+        job = client.post("/api/jobs", json={"kind": "export"}, headers=writer)
+        job_runner.wait(job.get_json()["id"], timeout=10)
+        used.clear()
+        assert client.get(job.headers["Location"], headers=writer).status_code == 200
+        assert set(used) == {primary}
+    finally:
+        for engine, listener in capture.items():
+            db.event.remove(engine, "before_cursor_execute", listener)
+
+    # The read bind is opened read-only.
+    from sqlalchemy.exc import OperationalError
+    with pytest.raises(OperationalError), read.begin() as conn:
+        conn.execute(db.text("DELETE FROM store"))
+
+def test_write_coordinator_forwards_writes_to_elected_writer(client, writer, tmp_path):
+    import app as app_module
+    from writecoordinator import WriteCoordinator
+    lock, sock = str(tmp_path / "writer.lock"), str(tmp_path / "writer.sock")
+    elected = WriteCoordinator(app, lock, sock, poll=0.05)
+    elected.start()
+    assert elected.elected.wait(5)
+    follower = WriteCoordinator(app, lock, sock, poll=0.05)
+    follower.start()
+    app_module.write_coordinator = follower
+    try:
+        assert not follower.is_writer
+        resp = client.post("/api/store/", json={"name": "A"}, headers=writer)
+        assert resp.status_code == 201
+        resp = client.post("/api/store/A/items/bulk", data=b'{"name": "I", "ip": "10.0.0.1"}\n',
+                           headers={**writer, "Content-Type": "application/x-ndjson"})
+        assert resp.status_code == 200 and resp.get_json()["accepted"] == 1
+        assert follower.forwarded == 2
+        assert client.get("/api/store/A", headers=writer).get_json()["item_count"] == 1
+
+        # The follower takes over once the writer steps down.
+        elected.stop()
+        assert follower.elected.wait(5)
+        assert client.post("/api/store/", json={"name": "B"}, headers=writer).status_code == 201
+        assert follower.forwarded == 2
+    finally:
+        app_module.write_coordinator = None
+        follower.stop()
+        elected.stop()
@@ -0,0 +1,152 @@
+import fcntl
+import http.client
+import os
+import socket
+import threading
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.serving import make_server
+
+# Not forwarded: they describe one hop of the connection, not the request.
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class WriteCoordinator:
+    """
+    Elect one writer among the processes sharing a SQLite file. The process
+    holding an exclusive lock on `lock_path` is the writer and also serves
+    the app on the Unix socket `socket_path`; the others forward their write
+    requests to it and answer reads from the file themselves. The lock goes
+    with the writer's process, so when it exits another process takes over
+    within `poll` seconds.
+    """
+    def __init__(self, app, lock_path, socket_path, timeout=60, poll=0.5):
+        self.app = app
+        self.lock_path = lock_path
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.poll = poll
+        self.elected = threading.Event()
+        self.forwarded = 0
+        self._stop = threading.Event()
+        self._lock_file = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def is_writer(self):
+        return self.elected.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="write-coordinator", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Step down (or stop waiting to be elected)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def should_forward(self, request):
+        """True for requests this process must hand to the writer."""
+        # Requests that arrived over the socket are always handled here, so
+        # a request cannot bounce between processes during a takeover.
+        return not self.is_writer and not request.environ.get("writecoordinator.forwarded")
+
+    def stats(self):
+        return {"writer": self.is_writer, "pid": os.getpid(), "forwarded": self.forwarded}
+
+    def forward(self, request):
+        """Send a write request to the writer and return its response."""
+        path = quote(request.environ.get("SCRIPT_NAME", "") + request.environ.get("PATH_INFO", ""))
+        query = request.environ.get("QUERY_STRING")
+        if query:
+            path += "?" + query
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP}
+        chunked = request.content_length is None and request.environ.get("wsgi.input_terminated")
+        if chunked:
+            headers["Transfer-Encoding"] = "chunked"
+        body = request.stream if request.content_length or chunked else None
+
+        conn = UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            conn.request(request.method, path, body=body, headers=headers, encode_chunked=bool(chunked))
+            upstream = conn.getresponse()
+        except (FileNotFoundError, ConnectionRefusedError):
+            conn.close()
+            # The writer is gone and no other process has taken over yet.
+            return Response(
+                '{"message": "No writer available, retry shortly"}\n', status=503,
+                headers={"Retry-After": "1"}, content_type="application/json",
+            )
+        except Exception:
+            conn.close()
+            raise
+        self.forwarded += 1
+
+        def body_chunks():
+            try:
+                while chunk := upstream.read(64 * 1024):
+                    yield chunk
+            finally:
+                conn.close()
+
+        response_headers = [(k, v) for k, v in upstream.getheaders() if k.lower() not in HOP_BY_HOP]
+        return Response(body_chunks(), status=upstream.status, headers=response_headers)
+
+    def _serve(self, environ, start_response):
+        environ["writecoordinator.forwarded"] = True
+        return self.app(environ, start_response)
+
+    def _run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        self._lock_file = open(self.lock_path, "a+")
+        try:
+            while not self._stop.is_set():
+                try:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    self._stop.wait(self.poll)
+            else:
+                return
+            self._lock_file.truncate(0)
+            self._lock_file.write(f"{socket.gethostname()}:{os.getpid()}\n")
+            self._lock_file.flush()
+            # Replaces the socket file left behind by a crashed writer.
+            self._server = make_server("unix://" + self.socket_path, 0, self._serve, threaded=True)
+            self._server.timeout = self.poll
+            self.elected.set()
+            self.app.logger.info("elected writer (pid %s), serving writes on %s",
+                                 os.getpid(), self.socket_path)
+            while not self._stop.is_set():
+                self._server.handle_request()
+        finally:
+            if self._server is not None:
+                self._server.server_close()
+                if self.elected.is_set() and os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+                self._server = None
+            self.elected.clear()
+            self._lock_file.close()